@@ -0,0 +1,209 @@
+"""Benchmark CompressMiddleware at the ASGI level, without an HTTP server.
+
+Results are written as JSON lines, one object per benchmark case:
+
+    python -m benchmarks.run --output results.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+from itertools import product
+from pathlib import Path
+from time import perf_counter
+
+import anyio
+
+from starlette_compress import CompressMiddleware
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from typing import TextIO
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SIZES = (1024, 64 * 1024, 1024 * 1024)
+STREAMING_CHUNK_SIZE = 16 * 1024
+LEVELS: dict[str, tuple[int, ...]] = {
+    'identity': (0,),
+    'zstd': (1, 4, 9),
+    'br': (1, 4, 9),
+    'gzip': (1, 4, 9),
+}
+LEVEL_OPTIONS = {
+    'zstd': 'zstd_level',
+    'br': 'brotli_quality',
+    'gzip': 'gzip_level',
+}
+
+
+def make_payload(content_type: str, size: int) -> bytes:
+    rng = random.Random(42)  # noqa: S311
+
+    if content_type == 'application/json':
+        items = (
+            json.dumps(
+                {
+                    'id': i,
+                    'name': f'user{rng.getrandbits(24)}',
+                    'score': rng.random(),
+                    'tags': rng.sample(['a', 'b', 'c', 'd', 'e'], k=2),
+                }
+            )
+            for i in range(size // 32 + 1)
+        )
+        data = ('[' + ','.join(items) + ']').encode()
+    elif content_type == 'text/html':
+        words = ('<div class="item">', '</div>', '<p>', '</p>', 'lorem', 'ipsum')
+        data = ' '.join(rng.choice(words) for _ in range(size // 4 + 1)).encode()
+    else:
+        data = rng.getrandbits(8 * size).to_bytes(size, 'big')
+
+    return data[:size]
+
+
+def make_app(content_type: str, body: bytes, *, streaming: bool) -> ASGIApp:
+    headers = [(b'content-type', content_type.encode())]
+    if not streaming:
+        headers.append((b'content-length', str(len(body)).encode()))
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        # headers are mutated by the middleware
+        await send(
+            {'type': 'http.response.start', 'status': 200, 'headers': headers.copy()}
+        )
+        if not streaming:
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        for i in range(0, len(body), STREAMING_CHUNK_SIZE):
+            await send(
+                {
+                    'type': 'http.response.body',
+                    'body': body[i : i + STREAMING_CHUNK_SIZE],
+                    'more_body': True,
+                }
+            )
+        await send({'type': 'http.response.body'})
+
+    return app
+
+
+async def request(middleware: ASGIApp, scope: Scope) -> int:
+    """Perform a single request and return the response body size."""
+    size = 0
+
+    async def receive() -> Message:
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: Message) -> None:
+        nonlocal size
+        if message['type'] == 'http.response.body':
+            size += len(message.get('body', b''))
+
+    await middleware(scope, receive, send)
+    return size
+
+
+async def run_case(
+    encoding: str,
+    level: int,
+    content_type: str,
+    size: int,
+    *,
+    streaming: bool,
+    min_time: float,
+) -> dict:
+    body = make_payload(content_type, size)
+    options = {LEVEL_OPTIONS[encoding]: level} if encoding in LEVEL_OPTIONS else {}
+    middleware = CompressMiddleware(
+        make_app(content_type, body, streaming=streaming), **options
+    )
+    scope: Scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': '/',
+        'headers': [(b'accept-encoding', encoding.encode())],
+    }
+
+    # warmup
+    output_size = await request(middleware, scope)
+
+    requests = 0
+    start = perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        await request(middleware, scope)
+        requests += 1
+        elapsed = perf_counter() - start
+
+    tracemalloc.start()
+    await request(middleware, scope)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'encoding': encoding,
+        'level': level,
+        'content_type': content_type,
+        'size': size,
+        'streaming': streaming,
+        'output_size': output_size,
+        'ratio': round(output_size / size, 4),
+        'requests_per_second': round(requests / elapsed, 1),
+        'megabytes_per_second': round(requests * size / elapsed / 1_000_000, 2),
+        'peak_memory_per_request': peak_memory,
+    }
+
+
+def iter_cases(encodings: list[str]) -> Iterator[tuple[str, int, str, int, bool]]:
+    # application/octet-stream is never compressed, wasm measures random binary bodies
+    content_types = ('application/json', 'text/html', 'application/wasm')
+    for encoding in encodings:
+        for level, content_type, size, streaming in product(
+            LEVELS[encoding], content_types, SIZES, (False, True)
+        ):
+            yield encoding, level, content_type, size, streaming
+
+
+async def main(encodings: list[str], min_time: float, output: TextIO) -> None:
+    for encoding, level, content_type, size, streaming in iter_cases(encodings):
+        result = await run_case(
+            encoding,
+            level,
+            content_type,
+            size,
+            streaming=streaming,
+            min_time=min_time,
+        )
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--encoding',
+        action='append',
+        choices=tuple(LEVELS),
+        help='Encoding to benchmark, can be repeated. Defaults to all.',
+    )
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.2,
+        help='Minimum measurement time per case in seconds.',
+    )
+    parser.add_argument('--output', help='Output file. Defaults to stdout.')
+    args = parser.parse_args()
+    encodings: list[str] = args.encoding or list(LEVELS)
+
+    if args.output:
+        with Path(args.output).open('w', encoding='utf-8') as f:
+            anyio.run(main, encodings, args.min_time, f)
+    else:
+        anyio.run(main, encodings, args.min_time, sys.stdout)
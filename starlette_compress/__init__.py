@@ -1,29 +1,82 @@
 from __future__ import annotations
 
+import os
 import sys
+from functools import partial
 
-from starlette.datastructures import Headers
-
+from starlette_compress._adaptive import AdaptiveLevel
+from starlette_compress._budget import MemoryBudget
+from starlette_compress._cache import CompressCache
+from starlette_compress._codec import Codec, StreamCompressor
+from starlette_compress._deflate import DeflateCodec
+from starlette_compress._dictionary import (
+    DictionaryRecorder,
+    DictionaryStore,
+    dictionary_hash,
+)
+from starlette_compress._flush import FlushPolicy
+from starlette_compress._gzip import GzipCodec
 from starlette_compress._identity import IdentityResponder
+from starlette_compress._metrics import (
+    CompressRecord,
+    OpenTelemetryTracing,
+    PrometheusMetrics,
+)
+from starlette_compress._offload import Offloader
+from starlette_compress._pool import CompressorPool
+from starlette_compress._request import RequestDecompressor
+from starlette_compress._responder import CompressResponder, SelectingResponder
+from starlette_compress._static import CompressStaticFiles, precompress_directory
+from starlette_compress._threads import set_zstd_max_threads
 from starlette_compress._utils import (
+    ContentTypeMatcher,
+    accepted_encodings,
     add_compress_type,
-    parse_accept_encoding,
+    decode_etag_conditions,
+    etag_encoding_pattern,
+    negotiate_encoding,
     remove_compress_type,
 )
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+    from typing import Any, Callable
+
     from starlette.types import ASGIApp, Receive, Scope, Send
 
+    from starlette_compress._responder import Selector
+
 __version__ = '1.6.1'
 
+_NEGOTIATION_CACHE_SIZE = 1024
+# responders of stored dictionaries, compiling a dictionary is expensive
+_DICTIONARY_CACHE_SIZE = 16
+_SUPPORTED_ENCODINGS = ('zstd', 'br', 'gzip')
+# options of the rules disabling compression, keeping the other wrappers
+_DISABLED_OPTIONS: dict[str, Any] = {
+    'zstd': False,
+    'zstd_dictionary': None,
+    'brotli': False,
+    'gzip': False,
+    'preference': (),
+    'codecs': (),
+}
+
 
 class CompressMiddleware:
     __slots__ = (
-        '_brotli',
-        '_gzip',
+        '_dcz',
+        '_dcz_factory',
+        '_dcz_hash',
+        '_dcz_responders',
+        '_dictionary_store',
+        '_etag_pattern',
         '_identity',
-        '_zstd',
+        '_negotiated',
+        '_responders',
+        '_rules',
+        '_selector',
         'app',
     )
 
@@ -34,72 +87,343 @@ class CompressMiddleware:
         minimum_size: int = 500,
         zstd: bool = True,
         zstd_level: int = 4,
+        zstd_dictionary: bytes | None = None,
+        zstd_threads: int = 0,
+        zstd_threads_threshold: int = 8 * 1024 * 1024,
         brotli: bool = True,
         brotli_quality: int = 4,
         gzip: bool = True,
         gzip_level: int = 4,
+        gzip_threads: int = 0,
+        gzip_threads_threshold: int = 8 * 1024 * 1024,
+        offload_threshold: int | None = None,
+        offload_max_threads: int | None = None,
+        preference: Sequence[str] = ('zstd', 'br', 'gzip'),
+        selector: Selector | None = None,
+        cache: CompressCache | None = None,
+        dictionary_store: DictionaryStore | None = None,
+        adaptive_budget: float | None = None,
+        adaptive_min_level: int = 1,
+        flush_size: int | None = None,
+        flush_delay: float | None = None,
+        coalesce_size: int | None = None,
+        lookahead_size: int = 0,
+        decompress_requests: bool = False,
+        request_max_size: int = 16 * 1024 * 1024,
+        request_max_ratio: float = 100,
+        rules: Mapping[str, Mapping[str, Any] | None] | None = None,
+        content_types: Iterable[str] | None = None,
+        compressor_pool_size: int = 16,
+        memory_budget: MemoryBudget | None = None,
+        metrics: Callable[[CompressRecord], None] | None = None,
+        incompressible_threshold: float | None = None,
+        codecs: Sequence[Codec] = (),
     ) -> None:
         """Compression middleware supporting multiple algorithms.
 
         The middleware automatically selects the best available compression method
-        based on the client's Accept-Encoding header. Compression methods are tried
-        in order: Zstandard, Brotli, Gzip, and finally no compression (identity).
+        based on the client's Accept-Encoding header, respecting quality values.
+        Equally preferred methods are tried in the server preference order, by default:
+        Zstandard, Brotli, Gzip, and finally no compression (identity).
 
         :param app: ASGI application to wrap.
         :param minimum_size: Minimum response size in bytes to apply compression.
         :param zstd: Enable Zstandard compression.
         :param zstd_level: Zstandard compression level. Valid values are all negative integers (faster) to 22 (best).
+        :param zstd_dictionary: Zstandard dictionary for the dcz encoding (Compression Dictionary Transport). Used when the client advertises it in the Available-Dictionary header.
+        :param zstd_threads: Zstandard worker threads per response, for bodies larger than zstd_threads_threshold. The total is limited process-wide with set_zstd_max_threads. Disabled if 0.
+        :param zstd_threads_threshold: Minimum body size in bytes for multi-threaded Zstandard compression. Streaming responses use their Content-Length header.
         :param brotli: Enable Brotli compression.
         :param brotli_quality: Brotli quality level, 0 (fastest) to 11 (best).
         :param gzip: Enable Gzip compression.
         :param gzip_level: Gzip compression level, 0 (fastest) to 9 (best).
+        :param gzip_threads: Worker threads compressing blocks of large non-streaming responses in parallel, shared by the concurrent responses of the middleware. Disabled if 0.
+        :param gzip_threads_threshold: Minimum body size in bytes for parallel Gzip compression.
+        :param offload_threshold: Minimum response size in bytes to compress in a worker thread. Disabled if None.
+        :param offload_max_threads: Maximum number of concurrent worker threads. Defaults to the number of CPUs.
+        :param preference: Server preference order of encodings ("zstd", "br", "gzip", and the encodings of codecs), used when the client has no preference. Unlisted encodings are tried last.
+        :param selector: Hook choosing the encoding and level of a compressible response when it starts, called with the encodings accepted by the client (best first, ties in the preference order), the ASGI scope, and the Content-Type and Content-Length of the response (None if unknown). Returns one of the given encodings with a level (None for the default level), or None for no compression. The X-Compress header takes precedence over the level.
+        :param cache: Cache of compressed non-streaming response bodies. Can be shared between multiple middleware instances.
+        :param dictionary_store: Store of responses marked with the Use-As-Dictionary header, used to delta-compress later responses with the dcz encoding.
+        :param adaptive_budget: Target fraction of time spent compressing, e.g., 0.5 for half of a CPU core. When exceeded, compression levels are lowered until the load drops. Disabled if None.
+        :param adaptive_min_level: Minimum compression level for the adaptive mode.
+        :param flush_size: Flush streaming responses after this many uncompressed bytes, trading compression ratio for latency. Use 0 to flush after every chunk. Disabled if None.
+        :param flush_delay: Flush streaming responses when no new data was sent for this many seconds. Disabled if None.
+        :param coalesce_size: Buffer small chunks of streaming responses until this many bytes are collected, before compressing them. Combine with flush_delay to bound the latency. Disabled if None.
+        :param lookahead_size: Buffer the first chunks of streaming responses up to this many bytes. Responses ending within the buffer are compressed at once, with the minimum size check and a Content-Length header. Holds back the first bytes of long-lived streams, like server-sent events. Disabled if 0.
+        :param decompress_requests: Decompress request bodies with the Content-Encoding header (Zstandard, Brotli, Gzip) before passing them to the application.
+        :param request_max_size: Maximum decompressed request body size in bytes. Larger requests fail with 413 Content Too Large.
+        :param request_max_ratio: Maximum request body compression ratio, to protect against decompression bombs. Checked for bodies larger than 64 KiB.
+        :param rules: Per-path overrides, mapping path prefixes to middleware options, e.g., `{'/export': {'zstd_level': 10}}`. The longest matching prefix applies, and unset options are inherited. None disables compression for the prefix.
+        :param content_types: Compressible content-types, supporting wildcards like `text/*` and `application/*+json`. Defaults to the types registered with add_compress_type.
+        :param compressor_pool_size: Maximum number of idle Zstandard contexts kept for reuse by streaming responses, avoiding the allocation of a new context per stream. Disabled if 0.
+        :param memory_budget: Memory budget of the compressors of concurrent streaming responses, applying its policy when exceeded. Can be shared between multiple middleware instances.
+        :param metrics: Hook called with the record of every response, like PrometheusMetrics or OpenTelemetryTracing. Disabled if None.
+        :param incompressible_threshold: Skip compression when a trial compression of the first 8 KiB of the body at the fastest level exceeds this fraction of its size, e.g., 0.9 for less than 10% savings. Disabled if None.
+        :param codecs: Additional codecs, like DeflateCodec, or subclasses of Codec. A codec replaces the built-in codec of the same encoding, e.g., GzipCodec with a faster backend.
         """
+        # options inherited by the rules
+        options = {
+            name: value
+            for name, value in locals().items()
+            if name not in {'self', 'app', 'rules'}
+        }
+
+        encodings = (*_SUPPORTED_ENCODINGS, *(codec.encoding for codec in codecs))
+        for encoding in preference:
+            if encoding not in encodings:
+                raise ValueError(f'Unsupported encoding {encoding!r}')
+
         self.app = app
-        self._identity = IdentityResponder(app, minimum_size)
+        self._rules: tuple[tuple[str, ASGIApp], ...] = ()
+        if rules:
+            self._rules = tuple(
+                (
+                    prefix.rstrip('/'),
+                    CompressMiddleware(
+                        app,
+                        **{
+                            **options,
+                            **(rule if rule is not None else _DISABLED_OPTIONS),
+                        },
+                    ),
+                )
+                for prefix, rule in sorted(
+                    rules.items(), key=lambda item: len(item[0]), reverse=True
+                )
+            )
 
+        if decompress_requests:
+            app = RequestDecompressor(app, request_max_size, request_max_ratio)
+
+        self._dictionary_store = dictionary_store
+        if dictionary_store is not None:
+            app = DictionaryRecorder(app, dictionary_store)
+
+        matcher = ContentTypeMatcher(content_types)
+        self._negotiated: dict[bytes, ASGIApp] = {}
+        self._selector = selector
+        self._dcz: ASGIApp | None = None
+        self._dcz_hash: str | None = None
+        self._dcz_factory: Callable[[bytes], ASGIApp] | None = None
+        self._dcz_responders: dict[str, ASGIApp] = {}
+
+        registry: dict[str, Codec] = {}
         if zstd:
             if sys.version_info < (3, 14):
-                from starlette_compress._zstd_legacy import ZstdResponder
+                from starlette_compress._zstd_legacy import ZstdCodec
             else:
-                from starlette_compress._zstd import ZstdResponder
+                from starlette_compress._zstd import ZstdCodec
 
-            self._zstd = ZstdResponder(app, minimum_size, zstd_level)
+            pool = (
+                CompressorPool(compressor_pool_size) if compressor_pool_size else None
+            )
+            zstd_codec = ZstdCodec(
+                zstd_level, pool, zstd_threads, zstd_threads_threshold
+            )
+            registry['zstd'] = zstd_codec
         else:
-            self._zstd = None
+            zstd_codec = None
 
         if brotli:
-            from starlette_compress._brotli import BrotliResponder
+            from starlette_compress._brotli import BrotliCodec
 
-            self._brotli = BrotliResponder(app, minimum_size, brotli_quality)
-        else:
-            self._brotli = None
+            registry['br'] = BrotliCodec(brotli_quality)
 
         if gzip:
-            from starlette_compress._gzip import GZipResponder
+            registry['gzip'] = GzipCodec(
+                gzip_level,
+                threads=gzip_threads,
+                threads_threshold=gzip_threads_threshold,
+            )
+
+        for codec in codecs:
+            registry[codec.encoding] = codec
+
+        self._identity = IdentityResponder(
+            app, minimum_size, matcher, metrics, enabled=bool(registry)
+        )
+
+        self._etag_pattern = etag_encoding_pattern((*dict.fromkeys(encodings), 'dcz'))
+
+        if offload_threshold is not None:
+            offloader = Offloader(
+                offload_threshold, offload_max_threads or os.cpu_count() or 1
+            )
+        else:
+            offloader = None
+
+        if adaptive_budget is not None and registry:
+            adaptive = AdaptiveLevel(
+                adaptive_budget,
+                adaptive_min_level,
+                max(codec.level for codec in registry.values()),
+            )
+        else:
+            adaptive = None
 
-            self._gzip = GZipResponder(app, minimum_size, gzip_level)
+        if (
+            flush_size is not None
+            or flush_delay is not None
+            or coalesce_size is not None
+        ):
+            flush = FlushPolicy(flush_size, flush_delay, coalesce_size)
         else:
-            self._gzip = None
+            flush = None
+
+        responder = partial(
+            CompressResponder,
+            app,
+            minimum_size=minimum_size,
+            offloader=offloader,
+            cache=cache,
+            adaptive=adaptive,
+            flush=flush,
+            lookahead=lookahead_size,
+            content_types=matcher,
+            budget=memory_budget,
+            metrics=metrics,
+            incompressible=incompressible_threshold,
+            etag_pattern=self._etag_pattern,
+        )
+        self._responders: dict[str, CompressResponder] = {
+            encoding: responder(registry[encoding])
+            for encoding in dict.fromkeys((*preference, *encodings))
+            if encoding in registry
+        }
+
+        if zstd_codec is not None:
+            if zstd_dictionary is not None:
+                self._dcz = responder(zstd_codec.with_dictionary(zstd_dictionary))
+                self._dcz_hash = dictionary_hash(zstd_dictionary)
+            if dictionary_store is not None:
+                self._dcz_factory = lambda dictionary: responder(
+                    zstd_codec.with_dictionary(dictionary)
+                )
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope['type'] != 'http':
             return await self.app(scope, receive, send)
 
-        accept_encoding = Headers(scope=scope).get('Accept-Encoding')
+        if self._rules:
+            path: str = scope['path']
+            for prefix, app in self._rules:
+                if path.startswith(prefix) and (
+                    len(path) == len(prefix) or path[len(prefix)] == '/'
+                ):
+                    return await app(scope, receive, send)
+
+        accept_encoding: bytes | None = None
+        available_dictionary: bytes | None = None
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                if accept_encoding is None:
+                    accept_encoding = value
+            elif name == b'available-dictionary' and available_dictionary is None:
+                available_dictionary = value
+
         if accept_encoding:
-            accept_encodings = parse_accept_encoding(accept_encoding)
-            if (self._zstd is not None) and 'zstd' in accept_encodings:
-                return await self._zstd(scope, receive, send)
-            if (self._brotli is not None) and 'br' in accept_encodings:
-                return await self._brotli(scope, receive, send)
-            if (self._gzip is not None) and 'gzip' in accept_encodings:
-                return await self._gzip(scope, receive, send)
+            if (
+                available_dictionary is not None
+                and negotiate_encoding(accept_encoding.decode('latin-1'), ('dcz',))
+                is not None
+            ):
+                responder = self._dictionary_responder(
+                    available_dictionary.decode('latin-1')
+                )
+                if responder is not None:
+                    return await responder(scope, receive, send)
+
+            responder = self._negotiated.get(accept_encoding)
+            if responder is None:
+                responder = self._negotiate(accept_encoding)
+            if responder is not self._identity:
+                return await responder(scope, receive, send)
 
+        scope = decode_etag_conditions(scope, self._etag_pattern)
         return await self._identity(scope, receive, send)
 
+    def _dictionary_responder(self, available_dictionary: str) -> ASGIApp | None:
+        if self._dcz is not None and available_dictionary == self._dcz_hash:
+            return self._dcz
+        responders = self._dcz_responders
+        responder = responders.pop(available_dictionary, None)
+        if responder is not None:
+            # move to the end, the least recently used entry is evicted first
+            responders[available_dictionary] = responder
+            return responder
+        store = self._dictionary_store
+        if store is not None and self._dcz_factory is not None:
+            dictionary = store.get(available_dictionary)
+            if dictionary is not None:
+                responder = self._dcz_factory(dictionary)
+                if len(responders) >= _DICTIONARY_CACHE_SIZE:
+                    del responders[next(iter(responders))]
+                responders[available_dictionary] = responder
+                return responder
+        return None
+
+    def _negotiate(self, accept_encoding: bytes) -> ASGIApp:
+        responder: ASGIApp
+        if self._selector is not None:
+            # the selector chooses among the accepted encodings when the response starts
+            accepted = accepted_encodings(
+                accept_encoding.decode('latin-1'), self._responders
+            )
+            responder = (
+                SelectingResponder(
+                    [self._responders[encoding] for encoding in accepted],
+                    self._selector,
+                )
+                if accepted
+                else self._identity
+            )
+        else:
+            encoding = negotiate_encoding(
+                accept_encoding.decode('latin-1'), self._responders
+            )
+            responder = (
+                self._responders[encoding] if encoding is not None else self._identity
+            )
+
+        negotiated = self._negotiated
+        if len(negotiated) >= _NEGOTIATION_CACHE_SIZE:
+            # evict the oldest entry
+            del negotiated[next(iter(negotiated))]
+        negotiated[accept_encoding] = responder
+        return responder
+
+
+def train_zstd_dictionary(samples: Iterable[bytes], size: int = 64 * 1024) -> bytes:
+    """Train a Zstandard dictionary from sample response bodies.
+
+    :param samples: Sample response bodies, ideally hundreds or more.
+    :param size: Maximum dictionary size in bytes.
+    """
+    if sys.version_info < (3, 14):
+        from starlette_compress._zstd_legacy import train_dictionary
+    else:
+        from starlette_compress._zstd import train_dictionary
+
+    return train_dictionary(list(samples), size)
+
 
 __all__ = (
+    'Codec',
+    'CompressCache',
     'CompressMiddleware',
+    'CompressRecord',
+    'CompressStaticFiles',
+    'DeflateCodec',
+    'DictionaryStore',
+    'GzipCodec',
+    'MemoryBudget',
+    'OpenTelemetryTracing',
+    'PrometheusMetrics',
+    'StreamCompressor',
     'add_compress_type',
+    'precompress_directory',
     'remove_compress_type',
+    'set_zstd_max_threads',
+    'train_zstd_dictionary',
 )
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from time import perf_counter
+
+
+class AdaptiveLevel:
+    __slots__ = (
+        '_busy',
+        '_window_start',
+        'budget',
+        'max_reduction',
+        'min_level',
+        'reduction',
+        'window',
+    )
+
+    def __init__(
+        self, budget: float, min_level: int, max_level: int, window: float = 1.0
+    ) -> None:
+        self.budget = budget
+        self.min_level = min_level
+        self.max_reduction = max(max_level - min_level, 0)
+        self.window = window
+        self.reduction = 0
+        self._busy = 0.0
+        self._window_start = perf_counter()
+
+    def level(self, level: int) -> int:
+        """Return the compression level adjusted to the current load."""
+        return max(min(level, self.min_level), level - self.reduction)
+
+    def record(self, elapsed: float) -> None:
+        """Record the time spent compressing, and adjust the levels every window."""
+        self._busy += elapsed
+        now = perf_counter()
+        span = now - self._window_start
+        if span <= self.window:
+            return
+
+        load = self._busy / span
+        if load > self.budget:
+            if self.reduction < self.max_reduction:
+                self.reduction += 1
+        elif load < self.budget / 2 and self.reduction:
+            self.reduction -= 1
+
+        self._busy = 0.0
+        self._window_start = now
@@ -2,9 +2,8 @@ from __future__ import annotations
 
 from platform import python_implementation
 
-from starlette.datastructures import MutableHeaders
-
-from starlette_compress._utils import is_start_message_satisfied
+from starlette_compress._budget import context_size
+from starlette_compress._codec import Codec, StreamCompressor
 
 TYPE_CHECKING = False
 
@@ -20,87 +19,84 @@ else:
         import brotli
 
 if TYPE_CHECKING:
-    from starlette.types import ASGIApp, Message, Receive, Scope, Send
-
-
-class BrotliResponder:
-    __slots__ = (
-        'app',
-        'minimum_size',
-        'quality',
-    )
-
-    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
-        self.app = app
-        self.minimum_size = minimum_size
-        self.quality = quality
-
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        start_message: Message | None = None
-        compressor: brotli.Compressor | None = None
-
-        async def wrapper(message: Message) -> None:
-            nonlocal start_message, compressor
-
-            message_type: str = message['type']
-
-            # handle start message
-            if message_type == 'http.response.start':
-                if start_message is not None:
-                    raise AssertionError(
-                        'Unexpected repeated http.response.start message'
-                    )
-
-                if is_start_message_satisfied(message):
-                    # capture start message and wait for response body
-                    start_message = message
-                    return
-                else:
-                    await send(message)
-                    return
-
-            # skip if start message is not satisfied or unknown message type
-            if start_message is None or message_type != 'http.response.body':
-                await send(message)
-                return
-
-            body: bytes = message.get('body', b'')
-            more_body: bool = message.get('more_body', False)
-
-            if compressor is None:
-                # skip compression for small responses
-                if not more_body and len(body) < self.minimum_size:
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                headers = MutableHeaders(raw=start_message['headers'])
-                headers['Content-Encoding'] = 'br'
-                headers.add_vary_header('Accept-Encoding')
-
-                if not more_body:
-                    # one-shot
-                    compressed_body: bytes = brotli.compress(body, quality=self.quality)
-                    headers['Content-Length'] = str(len(compressed_body))
-                    message['body'] = compressed_body
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                # begin streaming
-                del headers['Content-Length']
-                await send(start_message)
-                compressor = brotli.Compressor(quality=self.quality)
-
-            # streaming
-            chunk = compressor.process(body)
-            if chunk:
-                await send(
-                    {'type': 'http.response.body', 'body': chunk, 'more_body': True}
-                )
-            if more_body:
-                return
-            chunk = compressor.finish()
-            await send({'type': 'http.response.body', 'body': chunk})
-
-        await self.app(scope, receive, wrapper)
+    from starlette_compress._request import Decompressor
+
+
+class BrotliCodec(Codec):
+    __slots__ = ()
+
+    levels = range(12)
+    min_level = 0
+
+    def __init__(self, quality: int = 4) -> None:
+        """Brotli codec.
+
+        :param quality: Quality level, 0 (fastest) to 11 (best).
+        """
+        super().__init__('br', quality)
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        return brotli.compress(body, quality=level)
+
+    def compressor(self, level: int, size: int | None) -> _BrotliStream:  # noqa: ARG002
+        return _BrotliStream(brotli.Compressor(quality=level))
+
+    def context_size(self, level: int) -> int:
+        return context_size('br', level)
+
+
+class _BrotliStream(StreamCompressor):
+    __slots__ = ('compressor',)
+
+    def __init__(self, compressor: brotli.Compressor) -> None:
+        self.compressor = compressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class _BrotliDecompressor:
+    __slots__ = ('_decompressor',)
+
+    def __init__(self) -> None:
+        self._decompressor = brotli.Decompressor()
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.is_finished()
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        decompressor = self._decompressor
+        output = decompressor.process(data, output_buffer_limit=max_length)
+        # drain the pending output up to the limit
+        while len(output) < max_length and not decompressor.can_accept_more_data():
+            output += decompressor.process(
+                b'', output_buffer_limit=max_length - len(output)
+            )
+        return output
+
+
+def _supports_output_limit() -> bool:
+    try:
+        brotli.Decompressor().process(b'', output_buffer_limit=1)
+    except TypeError:
+        return False
+    return True
+
+
+# output limit requires brotli 1.2 or brotlicffi 1.2
+_OUTPUT_LIMIT = _supports_output_limit()
+
+
+def decompressor() -> Decompressor | None:
+    """Create an incremental decompressor for request bodies.
+
+    Returns None if the installed release cannot limit the output.
+    """
+    return _BrotliDecompressor() if _OUTPUT_LIMIT else None
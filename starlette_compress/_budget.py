@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import anyio
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from starlette_compress._codec import Codec
+
+# estimated memory of a streaming compression context in bytes
+_GZIP_CONTEXT_SIZE = 268 * 1024
+# measured by quality, with the default 4 MiB window
+_BROTLI_CONTEXT_SIZES = tuple(
+    size * 1024
+    for size in (
+        450, 770, 4560, 8400, 8400, 6950, 6950, 12560, 12560, 37320, 12460, 12460
+    )
+)  # fmt: skip
+# ZSTD_estimateCStreamSize by level, for streams of unknown size
+_ZSTD_CONTEXT_SIZES = tuple(
+    size * 1024
+    for size in (
+        569, 761, 1273, 2553, 3065, 3065, 5625, 5625, 10745, 20985, 20985,
+        41465, 33273, 49657, 66041, 33418, 49802, 50432, 83200, 165120,
+        328960, 656640,
+    )
+)  # fmt: skip
+
+_POLICIES = frozenset(('downgrade', 'identity', 'wait'))
+
+
+def context_size(encoding: str, level: int) -> int:
+    """Estimate the memory of a streaming compression context in bytes."""
+    if encoding == 'gzip':
+        return _GZIP_CONTEXT_SIZE
+    if encoding == 'br':
+        return _BROTLI_CONTEXT_SIZES[min(max(level, 0), 11)]
+    return _ZSTD_CONTEXT_SIZES[min(max(level, 1), 22) - 1]
+
+
+class MemoryBudget:
+    __slots__ = (
+        '_waiters',
+        'max_size',
+        'policy',
+        'size',
+    )
+
+    def __init__(self, max_size: int, policy: str = 'downgrade') -> None:
+        """Memory budget of the compression contexts of concurrent streaming responses.
+
+        The budget may be shared between multiple middleware instances.
+        Streams starting while the budget is exhausted are handled by the policy:
+
+        - "downgrade": compress at the fastest level, or send uncompressed if still over the budget.
+        - "identity": send uncompressed.
+        - "wait": wait until other streams finish.
+
+        A stream is always admitted when no other streams are active.
+
+        :param max_size: Maximum estimated memory of the active contexts in bytes.
+        :param policy: Policy applied when the budget is exhausted.
+        """
+        if policy not in _POLICIES:
+            raise ValueError(f'Unsupported memory budget policy {policy!r}')
+        self.max_size = max_size
+        self.policy = policy
+        self.size = 0
+        self._waiters: list[anyio.Event] = []
+
+    async def reserve(self, codec: Codec, level: int) -> tuple[int, int] | None:
+        """Reserve memory for a new stream.
+
+        Returns the compression level and the reserved size,
+        or None if the stream should be sent uncompressed.
+        """
+        size = codec.context_size(level)
+        if self._try_reserve(size):
+            return level, size
+
+        policy = self.policy
+        min_level = codec.min_level
+        if policy == 'downgrade' and level > min_level:
+            size = codec.context_size(min_level)
+            if self._try_reserve(size):
+                return min_level, size
+        elif policy == 'wait':
+            while not self._try_reserve(size):
+                event = anyio.Event()
+                self._waiters.append(event)
+                await event.wait()
+            return level, size
+
+        return None
+
+    def release(self, size: int) -> None:
+        """Release the memory of a finished stream, and wake up the waiting streams."""
+        self.size -= size
+        waiters = self._waiters
+        if waiters:
+            for event in waiters:
+                event.set()
+            waiters.clear()
+
+    def _try_reserve(self, size: int) -> bool:
+        if self.size and self.size + size > self.max_size:
+            return False
+        self.size += size
+        return True
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from hashlib import blake2b
+
+from starlette_compress._utils import encode_headers
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from starlette.types import Message, Scope, Send
+
+CacheKey = tuple[str, int, bytes]
+
+
+class CompressCache:
+    __slots__ = (
+        '_entries',
+        'hits',
+        'max_size',
+        'misses',
+        'size',
+    )
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024) -> None:
+        """Content-addressed cache of compressed response bodies.
+
+        The cache may be shared between multiple middleware instances.
+        Least recently used entries are evicted when the total size of
+        the compressed bodies exceeds the limit.
+
+        :param max_size: Maximum total size of the cached bodies in bytes.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[CacheKey, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(body: bytes, encoding: str, level: int) -> CacheKey:
+        """Compute the cache key for the given uncompressed body."""
+        return encoding, level, blake2b(body, digest_size=16).digest()
+
+    @staticmethod
+    def etag_key(
+        scope: Scope, message: Message, encoding: str, level: int
+    ) -> CacheKey | None:
+        """Compute the cache key for the response with a strong ETag.
+
+        ETags are only unique within a resource, so the key includes
+        the host, path, and query string of the request, and the values
+        of the request headers named in the Vary header.
+        Returns None if the response is not eligible for reuse,
+        like private or no-store responses.
+        """
+        if message['status'] != 200 or scope['method'] == 'HEAD':
+            return None
+        etag: bytes | None = None
+        vary: list[bytes] = []
+        for raw_name, value in message['headers']:
+            name = raw_name.lower()
+            if name == b'etag':
+                if etag is None:
+                    etag = value
+            elif name == b'vary':
+                vary.extend(item.strip().lower() for item in value.split(b','))
+            elif name == b'cache-control':
+                directives = {
+                    item.partition(b'=')[0].strip().lower()
+                    for item in value.split(b',')
+                }
+                if b'private' in directives or b'no-store' in directives:
+                    return None
+        if etag is None or etag.startswith(b'W/') or b'*' in vary:
+            return None
+
+        hasher = blake2b(etag, digest_size=16, person=b'etag')
+        request_headers: list[tuple[bytes, bytes]] = scope['headers']
+        for header_name, header_value in request_headers:
+            if header_name == b'host':
+                hasher.update(b'\0' + header_value)
+                break
+        hasher.update(b'\0' + scope['path'].encode())
+        hasher.update(b'\0' + scope.get('query_string', b''))
+        for vary_name in sorted(set(vary) - {b'accept-encoding', b''}):
+            # the response may differ by the value of the named request headers
+            hasher.update(b'\1' + vary_name)
+            for header_name, header_value in request_headers:
+                if header_name == vary_name:
+                    hasher.update(b'\0' + header_value)
+        return encoding, level, hasher.digest()
+
+    def get(self, key: CacheKey) -> bytes | None:
+        """Get the compressed body, or None if not cached."""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: CacheKey, value: bytes) -> None:
+        """Store the compressed body, evicting least recently used entries."""
+        value_size = len(value)
+        if value_size > self.max_size:
+            return
+
+        entries = self._entries
+        previous = entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+
+        while entries and self.size + value_size > self.max_size:
+            self.size -= len(entries.popitem(last=False)[1])
+
+        entries[key] = value
+        self.size += value_size
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        self._entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+async def send_cached(
+    send: Send,
+    start_message: Message,
+    encoding: str,
+    body: bytes,
+    vary: bytes = b'Accept-Encoding',
+) -> None:
+    """Send the response using the previously compressed body."""
+    encode_headers(start_message['headers'], encoding.encode(), len(body), vary)
+    await send(start_message)
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from starlette_compress._offload import Offloader
+
+# estimated memory of a streaming context of codecs without an estimate
+_DEFAULT_CONTEXT_SIZE = 256 * 1024
+
+
+class StreamCompressor:
+    __slots__ = ()
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk of the stream, returning the available output."""
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        """Flush the pending output, so the client can decode all data compressed so far."""
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        """End the stream, returning the remaining output."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the context when the response ends, whether finished or not."""
+
+
+class Codec:
+    __slots__ = (
+        'cache_encoding',
+        'encoding',
+        'level',
+        'prefix',
+        'vary',
+    )
+
+    # valid compression levels, per-response overrides are clamped to them
+    levels: range = range(10)
+    # lowest level the memory budget may downgrade streams to
+    min_level: int = 1
+
+    def __init__(self, encoding: str, level: int) -> None:
+        """Content coding used by CompressMiddleware, registered with its codecs option.
+
+        Subclasses implement one-shot compression with compress,
+        and streaming compression with a StreamCompressor created by compressor.
+
+        :param encoding: Content-Encoding token, e.g., "deflate".
+        :param level: Default compression level.
+        """
+        self.encoding = encoding
+        self.cache_encoding = encoding
+        self.level = level
+        self.prefix = b''
+        self.vary = b'Accept-Encoding'
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        """Compress the whole body. Must be thread-safe, as it may run in a worker thread."""
+        raise NotImplementedError
+
+    async def compress_async(
+        self, body: bytes, level: int, offloader: Offloader | None
+    ) -> bytes:
+        """Compress the whole body, in a worker thread if larger than the offload threshold."""
+        if offloader is not None and len(body) >= offloader.threshold:
+            return await offloader(self.compress, body, level)
+        return self.compress(body, level)
+
+    def offloaded(self, size: int, offloader: Offloader | None) -> bool:
+        """Check if compress_async compresses a body of the given size outside of the event loop thread.
+
+        Subclasses overriding compress_async with their own worker threads must override it too.
+        """
+        return offloader is not None and size >= offloader.threshold
+
+    def compressor(self, level: int, size: int | None) -> StreamCompressor:
+        """Create a streaming compression context.
+
+        :param level: Compression level.
+        :param size: Uncompressed size from the Content-Length header, if known.
+        """
+        raise NotImplementedError
+
+    def context_size(self, level: int) -> int:  # noqa: ARG002
+        """Estimate the memory of a streaming compression context in bytes."""
+        return _DEFAULT_CONTEXT_SIZE
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import zlib
+
+from starlette_compress._budget import context_size
+from starlette_compress._codec import Codec
+from starlette_compress._gzip import ZlibStream
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any
+
+
+class DeflateCodec(Codec):
+    __slots__ = ('backend',)
+
+    def __init__(self, level: int = 4, *, backend: Any = zlib) -> None:
+        """Deflate codec, producing the zlib format (RFC 1950) as required by HTTP.
+
+        :param level: Compression level, 0 (fastest) to 9 (best).
+        :param backend: Module implementing the zlib API, like isal.isal_zlib or zlib_ng.zlib_ng.
+        """
+        super().__init__('deflate', level)
+        self.backend = backend
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        return self.backend.compress(body, level)
+
+    def compressor(self, level: int, size: int | None) -> ZlibStream:  # noqa: ARG002
+        return ZlibStream(self.backend.compressobj(level))
+
+    def context_size(self, level: int) -> int:
+        return context_size('gzip', level)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from base64 import b64encode
+from collections import OrderedDict
+from hashlib import sha256
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# https://www.rfc-editor.org/rfc/rfc9842#name-dictionary-compressed-zstan
+DCZ_MAGIC = b'\x5e\x2a\x4d\x18\x20\x00\x00\x00'
+# clients support windows of 8 MB or 1.25 times the dictionary size, up to 128 MB
+_DCZ_MIN_WINDOW = 8 * 1024 * 1024
+_DCZ_MAX_WINDOW = 128 * 1024 * 1024
+# dictionaries larger than the default match tables of the fast levels
+_LARGE_DICTIONARY_SIZE = 1024 * 1024
+
+
+def dictionary_hash(dictionary: bytes) -> str:
+    """Compute the Available-Dictionary header value identifying the dictionary.
+
+    The value is a structured field byte sequence of the SHA-256 digest.
+    """
+    return f':{b64encode(sha256(dictionary).digest()).decode()}:'
+
+
+def dcz_prefix(dictionary: bytes) -> bytes:
+    """Return the header preceding the dictionary-compressed Zstandard stream."""
+    return DCZ_MAGIC + sha256(dictionary).digest()
+
+
+def dcz_window_log(dictionary_size: int) -> int:
+    """Largest Zstandard window log supported by dcz clients for the dictionary.
+
+    Frames of a known size are limited to a window covering the dictionary and
+    the body, like zstd --patch-from, so matches can reach back to its start.
+    """
+    window = min(max(_DCZ_MIN_WINDOW, dictionary_size * 5 // 4), _DCZ_MAX_WINDOW)
+    return window.bit_length() - 1
+
+
+def dcz_table_log(dictionary_size: int) -> int | None:
+    """Zstandard hash and chain table log indexing large dictionaries, None for small ones."""
+    if dictionary_size < _LARGE_DICTIONARY_SIZE:
+        return None
+    # a quarter of the positions, at most 4M entries
+    return min(dictionary_size.bit_length() - 2, 22)
+
+
+class DictionaryStore:
+    __slots__ = (
+        '_entries',
+        'max_size',
+        'size',
+    )
+
+    def __init__(self, max_size: int = 32 * 1024 * 1024) -> None:
+        """Store of recent response bodies marked as compression dictionaries.
+
+        Responses with the Use-As-Dictionary header are recorded, and later used
+        to delta-compress responses for clients advertising them in the
+        Available-Dictionary header. Least recently used dictionaries are evicted
+        when the total size exceeds the limit.
+
+        :param max_size: Maximum total size of the stored dictionaries in bytes.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> bytes | None:
+        """Get the dictionary by its Available-Dictionary header value."""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, dictionary: bytes) -> None:
+        """Store the dictionary, evicting least recently used entries."""
+        dictionary_size = len(dictionary)
+        if not dictionary_size or dictionary_size > self.max_size:
+            return
+
+        key = dictionary_hash(dictionary)
+        entries = self._entries
+        if key in entries:
+            entries.move_to_end(key)
+            return
+
+        while entries and self.size + dictionary_size > self.max_size:
+            self.size -= len(entries.popitem(last=False)[1])
+
+        entries[key] = dictionary
+        self.size += dictionary_size
+
+
+class DictionaryRecorder:
+    __slots__ = (
+        'app',
+        'store',
+    )
+
+    def __init__(self, app: ASGIApp, store: DictionaryStore) -> None:
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        chunks: list[bytes] | None = None
+        size: int = 0
+
+        async def wrapper(message: Message) -> None:
+            nonlocal chunks, size
+
+            message_type: str = message['type']
+
+            if message_type == 'http.response.start':
+                if message['status'] == 200 and any(
+                    name.lower() == b'use-as-dictionary'
+                    for name, _ in message['headers']
+                ):
+                    chunks = []
+
+            elif chunks is not None and message_type == 'http.response.body':
+                body: bytes = message.get('body', b'')
+                size += len(body)
+                if size > self.store.max_size:
+                    # too large to be stored
+                    chunks = None
+                else:
+                    chunks.append(body)
+                    if not message.get('more_body', False):
+                        self.store.put(b''.join(chunks))
+                        chunks = None
+
+            await send(message)
+
+        await self.app(scope, receive, wrapper)
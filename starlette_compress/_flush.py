@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import anyio
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from collections.abc import Awaitable
+    from typing import Callable
+
+    from anyio.abc import TaskGroup
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class FlushPolicy:
+    __slots__ = (
+        'coalesce',
+        'delay',
+        'size',
+    )
+
+    def __init__(
+        self, size: int | None, delay: float | None, coalesce: int | None
+    ) -> None:
+        self.size = size
+        self.delay = delay
+        self.coalesce = coalesce
+
+
+class _NoLock:
+    __slots__ = ()
+
+    async def __aenter__(self) -> None:
+        return None
+
+    async def __aexit__(self, *args: object) -> None:
+        return None
+
+
+NO_LOCK = _NoLock()
+
+
+class StreamFlusher:
+    __slots__ = (
+        '_buffer',
+        '_buffered',
+        '_deadline',
+        '_flush',
+        '_running',
+        '_task_group',
+        'coalesce',
+        'delay',
+        'lock',
+        'size',
+        'unflushed',
+    )
+
+    def __init__(
+        self, policy: FlushPolicy, flush: Callable[[bytes], Awaitable[None]]
+    ) -> None:
+        """Flush policy state of a single streaming response.
+
+        The lock must be held while writing to the compressor and sending its output,
+        as the idle timer flushes the compressor from a separate task.
+
+        :param policy: Flush policy to apply.
+        :param flush: Compress the pending input, flush the compressor and send its output.
+        """
+        self.size = policy.size
+        self.delay = policy.delay
+        self.coalesce = policy.coalesce
+        self.lock = anyio.Lock()
+        self.unflushed = 0
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+        self._flush = flush
+        self._deadline: float | None = None
+        self._running = False
+        self._task_group: TaskGroup | None = None
+
+    async def run(
+        self, app: ASGIApp, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Run the application, alongside the idle timer if enabled."""
+        if self.delay is None:
+            return await app(scope, receive, send)
+
+        error: Exception | None = None
+        async with anyio.create_task_group() as task_group:
+            self._task_group = task_group
+            try:
+                await app(scope, receive, send)
+            except Exception as e:
+                # re-raise outside of the task group, not as an exception group
+                error = e
+            self._deadline = None
+            task_group.cancel_scope.cancel()
+
+        if error is not None:
+            raise error
+
+    def coalesce_input(self, body: bytes, *, more_body: bool) -> bytes | None:
+        """Buffer small chunks until the coalesce size is reached.
+
+        Returns the input to compress now, or None if the body was buffered.
+        """
+        if self.coalesce is None:
+            return body
+
+        buffer = self._buffer
+        if more_body and self._buffered + len(body) < self.coalesce:
+            if body:
+                buffer.append(body)
+                self._buffered += len(body)
+                self._arm()
+            return None
+
+        if buffer:
+            buffer.append(body)
+            body = b''.join(buffer)
+            buffer.clear()
+            self._buffered = 0
+        return body
+
+    def written(self, size: int) -> bool:
+        """Account for the uncompressed bytes written to the compressor.
+
+        Returns True if the compressor should be flushed now.
+        """
+        self.unflushed += size
+        if self.size is not None and self.unflushed >= self.size:
+            self.unflushed = 0
+            self._deadline = None
+            return True
+
+        if self.unflushed:
+            self._arm()
+        return False
+
+    def close(self) -> None:
+        """Stop flushing, before the compressor is finished."""
+        self._deadline = None
+
+    def _arm(self) -> None:
+        if self.delay is None:
+            return
+        self._deadline = anyio.current_time() + self.delay
+        if not self._running and self._task_group is not None:
+            self._running = True
+            self._task_group.start_soon(self._idle_timer)
+
+    async def _idle_timer(self) -> None:
+        try:
+            while (deadline := self._deadline) is not None:
+                remaining = deadline - anyio.current_time()
+                if remaining > 0:
+                    await anyio.sleep(remaining)
+                    continue
+
+                async with self.lock:
+                    # skip if data was written in the meantime
+                    if self._deadline == deadline:
+                        self._deadline = None
+                        self.unflushed = 0
+                        pending = b''.join(self._buffer)
+                        self._buffer.clear()
+                        self._buffered = 0
+                        await self._flush(pending)
+        finally:
+            self._running = False
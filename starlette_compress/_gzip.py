@@ -1,110 +1,168 @@
 from __future__ import annotations
 
-import gzip
-from io import BytesIO
+import struct
+import sys
+import zlib
 
-from starlette.datastructures import MutableHeaders
+from anyio import CapacityLimiter, create_task_group, to_thread
 
-from starlette_compress._utils import is_start_message_satisfied
+from starlette_compress._budget import context_size
+from starlette_compress._codec import Codec, StreamCompressor
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
-    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+    from typing import Any
 
+    from starlette_compress._offload import Offloader
+    from starlette_compress._request import Decompressor
 
-class GZipResponder:
+# zlib window bits selecting the gzip container (header and trailer)
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+if sys.version_info >= (3, 11):
+
+    def gzip_compress(body: bytes, level: int) -> bytes:
+        """Compress the body into a gzip member in a single call."""
+        return zlib.compress(body, level, _GZIP_WBITS)
+
+else:
+
+    def gzip_compress(body: bytes, level: int) -> bytes:
+        """Compress the body into a gzip member in a single call."""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+        return compressor.compress(body) + compressor.flush()
+
+
+# input block size of the parallel compression
+_BLOCK_SIZE = 128 * 1024
+# deflate window size, the tail of the previous block primes the next one
+_WINDOW_SIZE = 32 * 1024
+# gzip header without a name, modification time, and an unknown OS
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def _compress_block(body: memoryview, start: int, level: int, backend: Any) -> bytes:
+    end = start + _BLOCK_SIZE
+    if start:
+        zdict = body[max(start - _WINDOW_SIZE, 0) : start]
+        compressor = backend.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict
+        )
+    else:
+        compressor = backend.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    chunk = compressor.compress(body[start:end])
+    if end < len(body):
+        # end on a byte boundary, without the final block marker
+        return chunk + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return chunk + compressor.flush()
+
+
+async def gzip_compress_parallel(
+    body: bytes, level: int, limiter: CapacityLimiter, backend: Any = zlib
+) -> bytes:
+    """Compress the body into a gzip member, with blocks compressed in worker threads.
+
+    Each block is primed with the tail of the previous block, like pigz,
+    and the raw deflate streams are joined into a single member.
+    """
+    view = memoryview(body)
+    # an empty body is a single empty block
+    starts = range(0, len(body), _BLOCK_SIZE) or range(1)
+    blocks: list[bytes] = [b''] * len(starts)
+    crc = 0
+
+    async def compress_block(i: int, start: int) -> None:
+        blocks[i] = await to_thread.run_sync(
+            _compress_block, view, start, level, backend, limiter=limiter
+        )
+
+    async def checksum() -> None:
+        nonlocal crc
+        crc = await to_thread.run_sync(backend.crc32, view, limiter=limiter)
+
+    async with create_task_group() as task_group:
+        task_group.start_soon(checksum)
+        for i, start in enumerate(starts):
+            task_group.start_soon(compress_block, i, start)
+
+    trailer = struct.pack('<II', crc, len(body) & 0xFFFFFFFF)
+    return b''.join((_GZIP_HEADER, *blocks, trailer))
+
+
+class GzipCodec(Codec):
     __slots__ = (
-        'app',
-        'level',
-        'minimum_size',
+        '_limiter',
+        'backend',
+        'threads',
+        'threads_threshold',
     )
 
-    def __init__(self, app: ASGIApp, minimum_size: int, level: int) -> None:
-        self.app = app
-        self.minimum_size = minimum_size
-        self.level = level
-
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        start_message: Message | None = None
-        compressor: gzip.GzipFile | None = None
-        buffer: BytesIO | None = None
-
-        async def wrapper(message: Message) -> None:
-            nonlocal start_message, compressor, buffer
-
-            message_type: str = message['type']
-
-            # handle start message
-            if message_type == 'http.response.start':
-                if start_message is not None:
-                    raise AssertionError(
-                        'Unexpected repeated http.response.start message'
-                    )
-
-                if is_start_message_satisfied(message):
-                    # capture start message and wait for response body
-                    start_message = message
-                    return
-                else:
-                    await send(message)
-                    return
-
-            # skip if start message is not satisfied or unknown message type
-            if start_message is None or message_type != 'http.response.body':
-                await send(message)
-                return
-
-            body: bytes = message.get('body', b'')
-            more_body: bool = message.get('more_body', False)
-
-            if compressor is None:
-                # skip compression for small responses
-                if not more_body and len(body) < self.minimum_size:
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                headers = MutableHeaders(raw=start_message['headers'])
-                headers['Content-Encoding'] = 'gzip'
-                headers.add_vary_header('Accept-Encoding')
-
-                if not more_body:
-                    # one-shot
-                    compressed_body = gzip.compress(body, compresslevel=self.level)
-                    headers['Content-Length'] = str(len(compressed_body))
-                    message['body'] = compressed_body
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                # begin streaming
-                del headers['Content-Length']
-                await send(start_message)
-                buffer = BytesIO()
-                compressor = gzip.GzipFile(
-                    mode='wb', compresslevel=self.level, fileobj=buffer
-                )
-
-            if buffer is None:
-                raise AssertionError('Compressor is set but buffer is not')
-
-            # streaming
-            compressor.write(body)
-            if not more_body:
-                compressor.close()
-            compressed_body = buffer.getvalue()
-            if more_body:
-                if compressed_body:
-                    buffer.seek(0)
-                    buffer.truncate()
-                else:
-                    return
-            await send(
-                {
-                    'type': 'http.response.body',
-                    'body': compressed_body,
-                    'more_body': more_body,
-                }
-            )
-
-        await self.app(scope, receive, wrapper)
+    def __init__(
+        self,
+        level: int = 4,
+        *,
+        threads: int = 0,
+        threads_threshold: int = 8 * 1024 * 1024,
+        backend: Any = zlib,
+    ) -> None:
+        """Gzip codec, with a zlib-compatible backend.
+
+        :param level: Compression level, 0 (fastest) to 9 (best).
+        :param threads: Worker threads compressing blocks of large non-streaming responses in parallel, shared by the concurrent responses. Disabled if 0.
+        :param threads_threshold: Minimum body size in bytes for parallel compression.
+        :param backend: Module implementing the zlib API, like isal.isal_zlib or zlib_ng.zlib_ng.
+        """
+        super().__init__('gzip', level)
+        self.threads = threads
+        self.threads_threshold = threads_threshold
+        self.backend = backend
+        self._limiter: CapacityLimiter | None = None
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        if self.backend is zlib:
+            return gzip_compress(body, level)
+        return self.backend.compress(body, level, _GZIP_WBITS)
+
+    async def compress_async(
+        self, body: bytes, level: int, offloader: Offloader | None
+    ) -> bytes:
+        if self.threads and len(body) >= self.threads_threshold:
+            limiter = self._limiter
+            if limiter is None:
+                # limiter must be created lazily, within a running event loop
+                limiter = self._limiter = CapacityLimiter(self.threads)
+            return await gzip_compress_parallel(body, level, limiter, self.backend)
+        return await super().compress_async(body, level, offloader)
+
+    def offloaded(self, size: int, offloader: Offloader | None) -> bool:
+        if self.threads and size >= self.threads_threshold:
+            return True
+        return super().offloaded(size, offloader)
+
+    def compressor(self, level: int, size: int | None) -> ZlibStream:  # noqa: ARG002
+        return ZlibStream(self.backend.compressobj(level, zlib.DEFLATED, _GZIP_WBITS))
+
+    def context_size(self, level: int) -> int:
+        return context_size('gzip', level)
+
+
+class ZlibStream(StreamCompressor):
+    __slots__ = ('compressor',)
+
+    def __init__(self, compressor: Any) -> None:
+        """Streaming context of a zlib-compatible compressor."""
+        self.compressor = compressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def decompressor() -> Decompressor:
+    """Create an incremental decompressor for request bodies."""
+    return zlib.decompressobj(_GZIP_WBITS)
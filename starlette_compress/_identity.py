@@ -1,68 +1,126 @@
 from __future__ import annotations
 
-from starlette.datastructures import MutableHeaders
-
-from starlette_compress._utils import is_start_message_satisfied
+from starlette_compress._metrics import ResponseRecorder
+from starlette_compress._utils import (
+    add_vary_header,
+    is_start_message_satisfied,
+    pop_compress_override,
+)
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
+    from typing import Callable
+
     from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+    from starlette_compress._metrics import CompressRecord
+    from starlette_compress._utils import ContentTypeMatcher
+
 
 class IdentityResponder:
     __slots__ = (
         'app',
+        'content_types',
+        'enabled',
+        'metrics',
         'minimum_size',
     )
 
-    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        content_types: ContentTypeMatcher,
+        metrics: Callable[[CompressRecord], None] | None,
+        *,
+        enabled: bool = True,
+    ) -> None:
         self.app = app
         self.minimum_size = minimum_size
+        self.content_types = content_types
+        self.metrics = metrics
+        # without any encodings, responses do not vary by Accept-Encoding
+        self.enabled = enabled
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        start_message: Message | None = None
-        headers_set: bool = False
-
-        async def wrapper(message: Message) -> None:
-            nonlocal start_message, headers_set
-
-            message_type: str = message['type']
-
-            # handle start message
-            if message_type == 'http.response.start':
-                if start_message is not None:
-                    raise AssertionError(
-                        'Unexpected repeated http.response.start message'
-                    )
-
-                if is_start_message_satisfied(message):
-                    # capture start message and wait for response body
-                    start_message = message
-                    return
-                else:
-                    await send(message)
-                    return
-
-            # skip if start message is not satisfied or unknown message type
-            if start_message is None or message_type != 'http.response.body':
+        state = _IdentityResponse(self, send)
+        if state.recorder is None:
+            return await self.app(scope, receive, state)
+        try:
+            await self.app(scope, receive, state)
+        finally:
+            state.recorder.close()
+
+
+class _IdentityResponse:
+    __slots__ = (
+        'headers_set',
+        'recorder',
+        'responder',
+        'send',
+        'start_message',
+    )
+
+    def __init__(self, responder: IdentityResponder, send: Send) -> None:
+        """State of a single response, receiving the application messages."""
+        self.responder = responder
+        self.send = send
+        self.recorder: ResponseRecorder | None = None
+        if responder.metrics is not None:
+            self.send = self.recorder = ResponseRecorder(
+                responder.metrics, send, 'identity', None
+            )
+        self.start_message: Message | None = None
+        self.headers_set = False
+
+    async def __call__(self, message: Message) -> None:
+        message_type: str = message['type']
+        send = self.send
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.received(message)
+
+        # handle start message
+        if message_type == 'http.response.start':
+            if self.start_message is not None:
+                raise AssertionError('Unexpected repeated http.response.start message')
+
+            enabled, _ = pop_compress_override(message)
+            enabled = enabled and self.responder.enabled
+            if enabled and is_start_message_satisfied(
+                message, self.responder.content_types
+            ):
+                # capture start message and wait for response body
+                self.start_message = message
+                return
+            else:
+                if recorder is not None and not enabled:
+                    recorder.decide('disabled')
                 await send(message)
                 return
 
-            if not headers_set:
-                body: bytes = message.get('body', b'')
-                more_body: bool = message.get('more_body', False)
+        # skip if start message is not satisfied or unknown message type
+        start_message = self.start_message
+        if start_message is None or message_type != 'http.response.body':
+            await send(message)
+            return
 
-                # skip compression for small responses
-                if not more_body and len(body) < self.minimum_size:
-                    await send(start_message)
-                    await send(message)
-                    return
+        if not self.headers_set:
+            body: bytes = message.get('body', b'')
+            more_body: bool = message.get('more_body', False)
 
-                headers = MutableHeaders(raw=start_message['headers'])
-                headers.add_vary_header('Accept-Encoding')
+            # skip compression for small responses
+            if not more_body and len(body) < self.responder.minimum_size:
+                if recorder is not None:
+                    recorder.decide('small')
                 await send(start_message)
-                headers_set = True
+                await send(message)
+                return
 
-            await send(message)
+            if recorder is not None:
+                recorder.decide('unaccepted', streaming=more_body)
+            add_vary_header(start_message['headers'], b'Accept-Encoding')
+            await send(start_message)
+            self.headers_set = True
 
-        await self.app(scope, receive, wrapper)
+        await send(message)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from time import thread_time, time_ns
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+    from starlette.types import Message, Send
+
+
+class CompressRecord:
+    __slots__ = (
+        'cpu_time',
+        'encoding',
+        'input_size',
+        'level',
+        'output_size',
+        'reason',
+        'streaming',
+        'wall_time',
+    )
+
+    def __init__(self, encoding: str, level: int | None) -> None:
+        """Record of a single response, reported to the metrics hook when it ends.
+
+        Reasons:
+
+        - "compressed": the body was compressed.
+        - "cached": a previously compressed body was reused.
+        - "small": the body was smaller than the minimum size.
+        - "incompressible": a trial compression of the body did not reach the threshold.
+        - "ineligible": the content-type is not compressible, or the body is already encoded.
+        - "disabled": compression was disabled with the X-Compress header, or by the selector.
+        - "memory": the stream was sent uncompressed, over the memory budget.
+        - "unaccepted": the client does not accept any supported encoding.
+        - "aborted": the response was cancelled or failed before completion.
+
+        The wall time includes waiting for worker threads. The CPU time only covers
+        compression on the event loop thread, and is None if the body was compressed
+        in worker threads, like with offloading or multi-threaded compression.
+
+        :param encoding: Negotiated encoding, "identity" if none.
+        :param level: Compression level, None if not compressed.
+        """
+        self.reason = 'ineligible'
+        self.encoding = encoding
+        self.level = level
+        self.streaming = False
+        self.input_size = 0
+        self.output_size = 0
+        self.wall_time = 0.0
+        self.cpu_time: float | None = 0.0
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'CompressRecord({fields})'
+
+
+class ResponseRecorder:
+    __slots__ = (
+        '_done',
+        '_metrics',
+        '_send',
+        'record',
+    )
+
+    def __init__(
+        self,
+        metrics: Callable[[CompressRecord], None],
+        send: Send,
+        encoding: str,
+        level: int | None,
+    ) -> None:
+        """Wrap the send callable, measuring the output and reporting the record."""
+        self.record = CompressRecord(encoding, level)
+        self._metrics = metrics
+        self._send = send
+        self._done = False
+
+    async def __call__(self, message: Message) -> None:
+        await self._send(message)
+        if message['type'] == 'http.response.body':
+            self.record.output_size += len(message.get('body', b''))
+            if not message.get('more_body', False) and not self._done:
+                self._done = True
+                self._metrics(self.record)
+
+    def decide(
+        self, reason: str, level: int | None = None, *, streaming: bool = False
+    ) -> None:
+        """Record the compression decision."""
+        record = self.record
+        record.reason = reason
+        record.streaming = streaming
+        if reason not in {'compressed', 'cached'}:
+            level = None
+        record.level = level
+
+    def received(self, message: Message) -> None:
+        """Account for the response body produced by the application."""
+        if message['type'] == 'http.response.body':
+            self.record.input_size += len(message.get('body', b''))
+
+    def timed(self, wall_time: float, cpu_start: float | None) -> None:
+        """Account for the compression time, given the thread time at the start.
+
+        The CPU time becomes unknown if cpu_start is None, for compression in worker threads.
+        """
+        record = self.record
+        record.wall_time += wall_time
+        if cpu_start is None:
+            record.cpu_time = None
+        elif record.cpu_time is not None:
+            record.cpu_time += thread_time() - cpu_start
+
+    def close(self) -> None:
+        """Report the record of a response that did not complete."""
+        if not self._done:
+            self._done = True
+            self.record.reason = 'aborted'
+            self._metrics(self.record)
+
+
+class PrometheusMetrics:
+    __slots__ = (
+        '_cpu_time',
+        '_input_size',
+        '_output_size',
+        '_responses',
+        '_wall_time',
+    )
+
+    def __init__(
+        self, prefix: str = 'starlette_compress', registry: Any = None
+    ) -> None:
+        """Metrics hook exporting Prometheus counters and histograms.
+
+        Requires the prometheus-client package.
+
+        :param prefix: Prefix of the metric names.
+        :param registry: Collector registry. Defaults to the global registry.
+        """
+        from prometheus_client import REGISTRY, Counter, Histogram  # type: ignore
+
+        if registry is None:
+            registry = REGISTRY
+        self._responses = Counter(
+            f'{prefix}_responses',
+            'Responses by encoding and compression decision.',
+            ('encoding', 'reason'),
+            registry=registry,
+        )
+        self._input_size = Counter(
+            f'{prefix}_input_bytes',
+            'Uncompressed bytes of compressed responses.',
+            ('encoding',),
+            registry=registry,
+        )
+        self._output_size = Counter(
+            f'{prefix}_output_bytes',
+            'Compressed bytes of compressed responses.',
+            ('encoding',),
+            registry=registry,
+        )
+        self._wall_time = Histogram(
+            f'{prefix}_duration_seconds',
+            'Time spent compressing a response.',
+            ('encoding',),
+            registry=registry,
+        )
+        self._cpu_time = Counter(
+            f'{prefix}_cpu_seconds',
+            'CPU time spent compressing on the event loop thread.',
+            ('encoding',),
+            registry=registry,
+        )
+
+    def __call__(self, record: CompressRecord) -> None:
+        encoding = record.encoding
+        self._responses.labels(encoding, record.reason).inc()
+        if record.reason != 'compressed':
+            return
+        self._input_size.labels(encoding).inc(record.input_size)
+        self._output_size.labels(encoding).inc(record.output_size)
+        self._wall_time.labels(encoding).observe(record.wall_time)
+        if record.cpu_time is not None:
+            self._cpu_time.labels(encoding).inc(record.cpu_time)
+
+
+class OpenTelemetryTracing:
+    __slots__ = ('_tracer',)
+
+    def __init__(self, tracer: Any = None) -> None:
+        """Metrics hook recording an OpenTelemetry span per compressed response.
+
+        The span covers the time spent compressing, ending when the response ends,
+        and is a child of the active span. Requires the opentelemetry-api package.
+
+        :param tracer: Tracer to create the spans with. Defaults to the global tracer provider.
+        """
+        if tracer is None:
+            from opentelemetry import trace  # type: ignore
+
+            tracer = trace.get_tracer('starlette_compress')
+        self._tracer = tracer
+
+    def __call__(self, record: CompressRecord) -> None:
+        if record.reason != 'compressed':
+            return
+        attributes = {
+            'compress.encoding': record.encoding,
+            'compress.level': record.level,
+            'compress.streaming': record.streaming,
+            'compress.input_size': record.input_size,
+            'compress.output_size': record.output_size,
+        }
+        if record.cpu_time is not None:
+            attributes['compress.cpu_time'] = record.cpu_time
+        end_time = time_ns()
+        span = self._tracer.start_span(
+            'compress',
+            start_time=end_time - int(record.wall_time * 1_000_000_000),
+            attributes=attributes,
+        )
+        span.end(end_time=end_time)
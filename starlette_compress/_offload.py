@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from anyio import CapacityLimiter, to_thread
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable
+
+
+class Offloader:
+    __slots__ = (
+        '_limiter',
+        'max_threads',
+        'threshold',
+    )
+
+    def __init__(self, threshold: int, max_threads: int) -> None:
+        self.threshold = threshold
+        self.max_threads = max_threads
+        self._limiter: CapacityLimiter | None = None
+
+    async def __call__(self, func: Callable[..., bytes], *args) -> bytes:
+        """Run the compression function in a worker thread."""
+        limiter = self._limiter
+        if limiter is None:
+            # limiter must be created lazily, within a running event loop
+            limiter = self._limiter = CapacityLimiter(self.max_threads)
+        return await to_thread.run_sync(func, *args, limiter=limiter)
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import Generic, TypeVar
+
+_T = TypeVar('_T')
+
+PoolKey = tuple[str, int]
+
+
+class CompressorPool(Generic[_T]):
+    __slots__ = (
+        '_idle',
+        'max_size',
+        'size',
+    )
+
+    def __init__(self, max_size: int) -> None:
+        """Bounded pool of idle compression contexts, reused by streaming responses.
+
+        Contexts are keyed by the encoding (including the dictionary) and the level.
+        Contexts returned to a full pool are discarded.
+
+        :param max_size: Maximum number of idle contexts kept in the pool.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._idle: dict[PoolKey, list[_T]] = {}
+
+    def get(self, key: PoolKey) -> _T | None:
+        """Take an idle context from the pool, or None if empty."""
+        idle = self._idle.get(key)
+        if not idle:
+            return None
+        self.size -= 1
+        return idle.pop()
+
+    def put(self, key: PoolKey, context: _T) -> None:
+        """Return a context, ready for the next stream, to the pool."""
+        if self.size >= self.max_size:
+            return
+        self._idle.setdefault(key, []).append(context)
+        self.size += 1
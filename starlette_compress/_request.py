@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import sys
+
+from starlette.exceptions import HTTPException
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Protocol
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+    class Decompressor(Protocol):
+        @property
+        def eof(self) -> bool: ...
+
+        def decompress(self, data: bytes, max_length: int, /) -> bytes: ...
+
+
+# ratio limit is not applied to small bodies, which may compress extremely well
+_RATIO_MIN_SIZE = 64 * 1024
+
+
+def _decompressor(encoding: bytes) -> Decompressor | None:
+    if encoding in {b'gzip', b'x-gzip'}:
+        from starlette_compress._gzip import decompressor
+    elif encoding == b'br':
+        from starlette_compress._brotli import decompressor
+    elif encoding == b'zstd':
+        if sys.version_info < (3, 14):
+            from starlette_compress._zstd_legacy import decompressor
+        else:
+            from starlette_compress._zstd import decompressor
+    else:
+        return None
+    return decompressor()
+
+
+class RequestDecompressor:
+    __slots__ = (
+        'app',
+        'max_ratio',
+        'max_size',
+    )
+
+    def __init__(self, app: ASGIApp, max_size: int, max_ratio: float) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding: bytes | None = None
+        headers: list[tuple[bytes, bytes]] = []
+        for name, value in scope['headers']:
+            lower_name = name.lower()
+            if lower_name == b'content-encoding':
+                encoding = value.strip().lower()
+            elif lower_name != b'content-length':
+                headers.append((name, value))
+
+        # encodings without a bounded decompressor are passed through
+        decompressor = _decompressor(encoding) if encoding is not None else None
+        if decompressor is None:
+            return await self.app(scope, receive, send)
+
+        received: int = 0
+        decompressed: int = 0
+
+        async def wrapper() -> Message:
+            nonlocal received, decompressed
+
+            message = await receive()
+            if message['type'] != 'http.request':
+                return message
+
+            body: bytes = message.get('body', b'')
+            if body:
+                received += len(body)
+                try:
+                    # output is limited to reject oversized bodies without inflating them
+                    body = decompressor.decompress(
+                        body, self.max_size - decompressed + 1
+                    )
+                except Exception as e:
+                    raise HTTPException(400, 'Malformed compressed request body') from e
+
+            decompressed += len(body)
+            if decompressed > self.max_size or (
+                decompressed > _RATIO_MIN_SIZE
+                and decompressed > received * self.max_ratio
+            ):
+                raise HTTPException(413, 'Decompressed request body is too large')
+
+            if (
+                received
+                and not message.get('more_body', False)
+                and not decompressor.eof
+            ):
+                raise HTTPException(400, 'Truncated compressed request body')
+
+            return {**message, 'body': body}
+
+        # the app receives the decompressed body
+        scope = {**scope, 'headers': headers}
+        await self.app(scope, wrapper, send)
@@ -0,0 +1,489 @@
+from __future__ import annotations
+
+from time import perf_counter, thread_time
+
+from starlette_compress._cache import send_cached
+from starlette_compress._flush import NO_LOCK, StreamFlusher
+from starlette_compress._metrics import ResponseRecorder
+from starlette_compress._utils import (
+    add_vary_header,
+    decode_etag_conditions,
+    encode_headers,
+    encode_not_modified_headers,
+    get_header,
+    has_encoded_etag_condition,
+    is_incompressible,
+    is_start_message_satisfied,
+    pop_compress_override,
+    set_header,
+)
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import re
+    from collections.abc import Sequence
+    from typing import Callable
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+    from starlette_compress._adaptive import AdaptiveLevel
+    from starlette_compress._budget import MemoryBudget
+    from starlette_compress._cache import CacheKey, CompressCache
+    from starlette_compress._codec import Codec, StreamCompressor
+    from starlette_compress._flush import FlushPolicy
+    from starlette_compress._metrics import CompressRecord
+    from starlette_compress._offload import Offloader
+    from starlette_compress._utils import ContentTypeMatcher
+
+    # called with the accepted encodings, the scope, the content-type and length,
+    # returns the encoding and level, or None for no compression
+    Selector = Callable[
+        [Sequence[str], Scope, 'str | None', 'int | None'],
+        'tuple[str, int | None] | None',
+    ]
+
+
+class CompressResponder:
+    __slots__ = (
+        'adaptive',
+        'app',
+        'budget',
+        'cache',
+        'codec',
+        'content_types',
+        'encoding',
+        'etag_pattern',
+        'flush',
+        'incompressible',
+        'lookahead',
+        'metrics',
+        'minimum_size',
+        'offloader',
+    )
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        codec: Codec,
+        *,
+        minimum_size: int,
+        offloader: Offloader | None,
+        cache: CompressCache | None,
+        adaptive: AdaptiveLevel | None,
+        flush: FlushPolicy | None,
+        lookahead: int,
+        content_types: ContentTypeMatcher,
+        budget: MemoryBudget | None,
+        metrics: Callable[[CompressRecord], None] | None,
+        incompressible: float | None,
+        etag_pattern: re.Pattern[bytes],
+    ) -> None:
+        self.app = app
+        self.codec = codec
+        self.encoding = codec.encoding.encode()
+        self.minimum_size = minimum_size
+        self.offloader = offloader
+        self.cache = cache
+        self.adaptive = adaptive
+        self.flush = flush
+        self.lookahead = lookahead
+        self.content_types = content_types
+        self.budget = budget
+        self.metrics = metrics
+        self.incompressible = incompressible
+        self.etag_pattern = etag_pattern
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.run(_CompressResponse(self, scope, send, None), scope, receive)
+
+    async def run(
+        self, state: _CompressResponse, scope: Scope, receive: Receive
+    ) -> None:
+        """Run the application, sending its messages through the response state."""
+        # the state keeps the original conditions, to encode the ETag of 304 responses
+        scope = decode_etag_conditions(scope, self.etag_pattern)
+        try:
+            if state.flusher is None:
+                await self.app(scope, receive, state)
+            else:
+                await state.flusher.run(self.app, scope, receive, state)
+        finally:
+            # release the context of cancelled and failed responses
+            state.release()
+            if state.recorder is not None:
+                state.recorder.close()
+
+    async def compress(
+        self, body: bytes, level: int, etag_key: CacheKey | None
+    ) -> bytes:
+        """Compress the whole body, reusing the cached result if available."""
+        codec = self.codec
+        cache = self.cache
+        if cache is not None:
+            cache_key = cache.key(body, codec.cache_encoding, level)
+            compressed_body = cache.get(cache_key)
+            if compressed_body is None:
+                compressed_body = codec.prefix + await codec.compress_async(
+                    body, level, self.offloader
+                )
+                cache.put(cache_key, compressed_body)
+            if etag_key is not None:
+                cache.put(etag_key, compressed_body)
+            return compressed_body
+        return codec.prefix + await codec.compress_async(body, level, self.offloader)
+
+
+class SelectingResponder:
+    __slots__ = (
+        'choices',
+        'encodings',
+        'responder',
+        'selector',
+    )
+
+    def __init__(
+        self, responders: Sequence[CompressResponder], selector: Selector
+    ) -> None:
+        """Responder choosing the encoding and level when the response starts.
+
+        :param responders: Responders of the encodings accepted by the client, best first.
+        :param selector: Hook called with the accepted encodings, the scope, and the
+            Content-Type and Content-Length of the response.
+        """
+        self.responder = responders[0]
+        self.choices = {responder.codec.encoding: responder for responder in responders}
+        self.encodings = tuple(self.choices)
+        self.selector = selector
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        responder = self.responder
+        await responder.run(
+            _CompressResponse(responder, scope, send, self), scope, receive
+        )
+
+    def select(
+        self, scope: Scope, message: Message
+    ) -> tuple[CompressResponder, int | None] | None:
+        """Select the responder and level for the start message, None for no compression."""
+        headers: list[tuple[bytes, bytes]] = message['headers']
+        content_type = get_header(headers, b'content-type')
+        content_length = get_header(headers, b'content-length')
+        selection = self.selector(
+            self.encodings,
+            scope,
+            content_type.decode('latin-1') if content_type is not None else None,
+            int(content_length) if content_length is not None else None,
+        )
+        if selection is None:
+            return None
+        encoding, level = selection
+        responder = self.choices.get(encoding)
+        if responder is None:
+            raise ValueError(f'Selected encoding {encoding!r} is not accepted')
+        return responder, level
+
+
+class _CompressResponse:
+    __slots__ = (
+        'compressor',
+        'etag_key',
+        'flusher',
+        'level',
+        'lookahead',
+        'recorder',
+        'reserved',
+        'responder',
+        'reused',
+        'scope',
+        'selection',
+        'send',
+        'start_message',
+    )
+
+    def __init__(
+        self,
+        responder: CompressResponder,
+        scope: Scope,
+        send: Send,
+        selection: SelectingResponder | None,
+    ) -> None:
+        """State of a single response, receiving the application messages.
+
+        With a selection, the responder is replaced when the response starts.
+        """
+        self.responder = responder
+        self.selection = selection
+        self.scope = scope
+        self.send = send
+        self.recorder: ResponseRecorder | None = None
+        if responder.metrics is not None:
+            self.send = self.recorder = ResponseRecorder(
+                responder.metrics, send, responder.codec.encoding, None
+            )
+        self.start_message: Message | None = None
+        self.etag_key: CacheKey | None = None
+        self.reused = False
+        self.level = responder.codec.level
+        self.compressor: StreamCompressor | None = None
+        self.lookahead: bytearray | None = None
+        self.reserved = 0
+        self.flusher = (
+            StreamFlusher(responder.flush, self.idle_flush)
+            if responder.flush is not None
+            else None
+        )
+
+    async def __call__(self, message: Message) -> None:
+        message_type: str = message['type']
+        responder = self.responder
+        codec = responder.codec
+        send = self.send
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.received(message)
+
+        # handle start message
+        if message_type == 'http.response.start':
+            if self.start_message is not None:
+                raise AssertionError('Unexpected repeated http.response.start message')
+
+            enabled, override = pop_compress_override(message)
+            selection = self.selection
+            if enabled and message['status'] == 304:
+                # revalidation of the encoded representation keeps its ETag
+                choices = (
+                    selection.choices.values()
+                    if selection is not None
+                    else (responder,)
+                )
+                for choice in choices:
+                    if has_encoded_etag_condition(self.scope, choice.encoding):
+                        encode_not_modified_headers(
+                            message['headers'], choice.encoding, choice.codec.vary
+                        )
+                        break
+                await send(message)
+                return
+            if enabled and is_start_message_satisfied(message, responder.content_types):
+                selected_level = None
+                if selection is not None:
+                    selected = selection.select(self.scope, message)
+                    if selected is None:
+                        # the selector skipped compression for this response
+                        if recorder is not None:
+                            recorder.decide('disabled')
+                        add_vary_header(message['headers'], b'Accept-Encoding')
+                        await send(message)
+                        return
+                    responder, selected_level = selected
+                    if responder is not self.responder:
+                        self.responder = responder
+                        codec = responder.codec
+                        self.level = codec.level
+                        if recorder is not None:
+                            recorder.record.encoding = codec.encoding
+
+                if override is not None:
+                    self.level = _clamp_level(codec, override)
+                else:
+                    if selected_level is not None:
+                        self.level = _clamp_level(codec, selected_level)
+                    if responder.adaptive is not None:
+                        self.level = responder.adaptive.level(self.level)
+
+                cache = responder.cache
+                if cache is not None:
+                    etag_key = cache.etag_key(
+                        self.scope, message, codec.cache_encoding, self.level
+                    )
+                    if etag_key is not None:
+                        cached_body = cache.get(etag_key)
+                        if cached_body is not None:
+                            if recorder is not None:
+                                recorder.decide('cached', self.level)
+                            await send_cached(
+                                send, message, codec.encoding, cached_body, codec.vary
+                            )
+                            self.reused = True
+                            return
+                    self.etag_key = etag_key
+
+                # capture start message and wait for response body
+                self.start_message = message
+                return
+            else:
+                if recorder is not None and not enabled:
+                    recorder.decide('disabled')
+                await send(message)
+                return
+
+        # discard the body of a reused response
+        if self.reused and message_type == 'http.response.body':
+            return
+
+        # skip if start message is not satisfied or unknown message type
+        start_message = self.start_message
+        if start_message is None or message_type != 'http.response.body':
+            await send(message)
+            return
+
+        body: bytes = message.get('body', b'')
+        more_body: bool = message.get('more_body', False)
+        compressor = self.compressor
+
+        if compressor is None:
+            lookahead = self.lookahead
+            if responder.lookahead and (more_body or lookahead):
+                # buffer early chunks, the response may end within the lookahead
+                if lookahead is None:
+                    lookahead = self.lookahead = bytearray()
+                lookahead.extend(body)
+                if more_body and len(lookahead) < responder.lookahead:
+                    return
+                body = message['body'] = bytes(lookahead)
+                self.lookahead = None
+                if not more_body:
+                    set_header(
+                        start_message['headers'], b'content-length', b'%d' % len(body)
+                    )
+
+            # skip compression for small responses
+            if not more_body and len(body) < responder.minimum_size:
+                if recorder is not None:
+                    recorder.decide('small')
+                await send(start_message)
+                await send(message)
+                return
+
+            # skip compression for incompressible responses
+            if responder.incompressible is not None and is_incompressible(
+                body, responder.incompressible
+            ):
+                if recorder is not None:
+                    recorder.decide('incompressible')
+                self.start_message = None
+                await send(start_message)
+                await send(message)
+                return
+
+            if not more_body:
+                # one-shot
+                if recorder is not None:
+                    recorder.decide('compressed', self.level)
+                # other requests run while waiting for worker threads,
+                # only time compression on the event loop thread
+                offloaded = codec.offloaded(len(body), responder.offloader)
+                cpu_start = (
+                    thread_time() if recorder is not None and not offloaded else None
+                )
+                start = perf_counter()
+                compressed_body = await responder.compress(
+                    body, self.level, self.etag_key
+                )
+                elapsed = perf_counter() - start
+                if responder.adaptive is not None and not offloaded:
+                    responder.adaptive.record(elapsed)
+                if recorder is not None:
+                    recorder.timed(elapsed, cpu_start)
+                encode_headers(
+                    start_message['headers'],
+                    responder.encoding,
+                    len(compressed_body),
+                    codec.vary,
+                )
+                message['body'] = compressed_body
+                await send(start_message)
+                await send(message)
+                return
+
+            # begin streaming
+            content_length = get_header(start_message['headers'], b'content-length')
+            budget = responder.budget
+            if budget is not None:
+                reservation = await budget.reserve(codec, self.level)
+                if reservation is None:
+                    # over the memory budget, send the stream uncompressed
+                    if recorder is not None:
+                        recorder.decide('memory')
+                    self.start_message = None
+                    add_vary_header(start_message['headers'], b'Accept-Encoding')
+                    await send(start_message)
+                    await send(message)
+                    return
+                self.level, self.reserved = reservation
+            if recorder is not None:
+                recorder.decide('compressed', self.level, streaming=True)
+            encode_headers(
+                start_message['headers'], responder.encoding, None, codec.vary
+            )
+            await send(start_message)
+            if codec.prefix:
+                await send(
+                    {
+                        'type': 'http.response.body',
+                        'body': codec.prefix,
+                        'more_body': True,
+                    }
+                )
+            compressor = self.compressor = codec.compressor(
+                self.level,
+                int(content_length) if content_length is not None else None,
+            )
+
+        # streaming
+        flusher = self.flusher
+        async with flusher.lock if flusher is not None else NO_LOCK:
+            if flusher is not None:
+                data = flusher.coalesce_input(body, more_body=more_body)
+                if data is None:
+                    return
+                body = data
+            cpu_start = thread_time() if recorder is not None else None
+            start = perf_counter()
+            chunk = compressor.compress(body)
+            if more_body and flusher is not None and flusher.written(len(body)):
+                chunk += compressor.flush()
+            elapsed = perf_counter() - start
+            if responder.adaptive is not None:
+                responder.adaptive.record(elapsed)
+            if recorder is not None:
+                recorder.timed(elapsed, cpu_start)
+            if chunk:
+                await send(
+                    {'type': 'http.response.body', 'body': chunk, 'more_body': True}
+                )
+            if more_body:
+                return
+            if flusher is not None:
+                flusher.close()
+            chunk = compressor.finish()
+            self.release()
+            await send({'type': 'http.response.body', 'body': chunk})
+
+    async def idle_flush(self, pending: bytes) -> None:
+        compressor = self.compressor
+        if compressor is None:
+            return
+        chunk = compressor.compress(pending) + compressor.flush()
+        if chunk:
+            await self.send(
+                {'type': 'http.response.body', 'body': chunk, 'more_body': True}
+            )
+
+    def release(self) -> None:
+        """Close the streaming context, and release its memory reservation."""
+        if self.reserved:
+            budget = self.responder.budget
+            if budget is not None:
+                budget.release(self.reserved)
+            self.reserved = 0
+        compressor = self.compressor
+        if compressor is not None:
+            self.compressor = None
+            compressor.close()
+
+
+def _clamp_level(codec: Codec, level: int) -> int:
+    """Clamp the level to the valid levels of the codec."""
+    levels = codec.levels
+    return min(max(level, levels.start), levels.stop - 1)
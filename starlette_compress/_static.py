@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import stat
+import sys
+from mimetypes import guess_type
+from pathlib import Path
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from starlette_compress._utils import is_compress_type, negotiate_encoding
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Sequence
+    from typing import Callable
+
+    from starlette.responses import Response
+    from starlette.types import Scope
+
+_SIDECAR_SUFFIXES: dict[str, str] = {
+    'zstd': '.zst',
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+class CompressStaticFiles(StaticFiles):
+    def __init__(
+        self, *args, encodings: Sequence[str] = ('zstd', 'br', 'gzip'), **kwargs
+    ) -> None:
+        """Static files application serving precompressed sidecar files.
+
+        For a requested file, e.g., `app.js`, the `app.js.zst`, `app.js.br`, and `app.js.gz`
+        files are served directly when accepted by the client. When no sidecar
+        file exists, the original file is served, and may be compressed by the middleware.
+
+        :param encodings: Server preference order of sidecar encodings ("zstd", "br", "gzip").
+        """
+        for encoding in encodings:
+            if encoding not in _SIDECAR_SUFFIXES:
+                raise ValueError(f'Unsupported encoding {encoding!r}')
+        super().__init__(*args, **kwargs)
+        self.encodings = tuple(encodings)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope['method'] in {'GET', 'HEAD'}:
+            accept_encoding = Headers(scope=scope).get('Accept-Encoding')
+            if accept_encoding:
+                response = await self._sidecar_response(path, scope, accept_encoding)
+                if response is not None:
+                    return response
+        return await super().get_response(path, scope)
+
+    async def _sidecar_response(
+        self, path: str, scope: Scope, accept_encoding: str
+    ) -> Response | None:
+        encodings = list(self.encodings)
+        while True:
+            encoding = negotiate_encoding(accept_encoding, encodings)
+            if encoding is None:
+                return None
+            encodings.remove(encoding)
+
+            try:
+                full_path, stat_result = await anyio.to_thread.run_sync(
+                    self.lookup_path, path + _SIDECAR_SUFFIXES[encoding]
+                )
+            except (OSError, ValueError):
+                continue
+            if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                continue
+
+            media_type = guess_type(path)[0] or 'text/plain'
+            response = FileResponse(
+                full_path,
+                stat_result=stat_result,
+                media_type=media_type,
+                headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+            )
+            if self.is_not_modified(response.headers, Headers(scope=scope)):
+                return NotModifiedResponse(response.headers)
+            return response
+
+
+def precompress_directory(
+    directory: str | os.PathLike[str],
+    *,
+    minimum_size: int = 500,
+    zstd: bool = True,
+    zstd_level: int = 19,
+    brotli: bool = True,
+    brotli_quality: int = 11,
+    gzip: bool = True,
+    gzip_level: int = 9,
+) -> None:
+    """Generate precompressed sidecar files for all compressible files in the directory.
+
+    Intended to run at build time, with the highest compression levels by default.
+    Sidecar files newer than the original file are not regenerated. Sidecar files
+    which are not smaller than the original file are not created.
+
+    :param directory: Directory to process recursively.
+    :param minimum_size: Minimum file size in bytes to compress.
+    :param zstd: Generate Zstandard (.zst) sidecar files.
+    :param zstd_level: Zstandard compression level.
+    :param brotli: Generate Brotli (.br) sidecar files.
+    :param brotli_quality: Brotli quality level.
+    :param gzip: Generate Gzip (.gz) sidecar files.
+    :param gzip_level: Gzip compression level.
+    """
+    compressors: list[tuple[str, Callable[[bytes], bytes]]] = []
+
+    if zstd:
+        if sys.version_info < (3, 14):
+            from zstandard import compress as zstd_compress  # type: ignore
+        else:
+            from compression.zstd import compress as zstd_compress  # type: ignore
+
+        compressors.append(('.zst', lambda data: zstd_compress(data, zstd_level)))
+
+    if brotli:
+        from starlette_compress._brotli import brotli as brotli_module
+
+        compressors.append(
+            (
+                '.br',
+                lambda data: brotli_module.compress(data, quality=brotli_quality),
+            )
+        )
+
+    if gzip:
+        import gzip as gzip_module
+
+        compressors.append(
+            (
+                '.gz',
+                lambda data: gzip_module.compress(data, gzip_level, mtime=0),
+            )
+        )
+
+    sidecar_suffixes = frozenset(_SIDECAR_SUFFIXES.values())
+
+    for path in sorted(Path(directory).rglob('*')):
+        if path.suffix in sidecar_suffixes or not path.is_file():
+            continue
+
+        content_type = guess_type(path.name)[0]
+        if content_type is None or not is_compress_type(content_type):
+            continue
+
+        stat_result = path.stat()
+        if stat_result.st_size < minimum_size:
+            continue
+
+        data: bytes | None = None
+        for suffix, compress in compressors:
+            sidecar = path.with_name(path.name + suffix)
+            if sidecar.is_file() and sidecar.stat().st_mtime >= stat_result.st_mtime:
+                continue
+
+            if data is None:
+                data = path.read_bytes()
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                sidecar.write_bytes(compressed)
+            else:
+                sidecar.unlink(missing_ok=True)
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import os
+
+
+class WorkerThreads:
+    __slots__ = (
+        'max_threads',
+        'used',
+    )
+
+    def __init__(self, max_threads: int) -> None:
+        """Process-wide limit of the compression worker threads of concurrent responses.
+
+        :param max_threads: Maximum total number of worker threads.
+        """
+        self.max_threads = max_threads
+        self.used = 0
+
+    def acquire(self, threads: int) -> int:
+        """Reserve up to the given number of worker threads.
+
+        Returns the number of reserved threads, or 0 if fewer than 2 are available,
+        as a single worker thread does not speed up compression.
+        """
+        threads = min(threads, self.max_threads - self.used)
+        if threads < 2:
+            return 0
+        self.used += threads
+        return threads
+
+    def release(self, threads: int) -> None:
+        """Release the reserved worker threads."""
+        self.used -= threads
+
+
+zstd_worker_threads = WorkerThreads(os.cpu_count() or 1)
+
+
+def set_zstd_max_threads(max_threads: int) -> None:
+    """Set the process-wide limit of Zstandard worker threads, shared by all middleware instances.
+
+    Defaults to the number of CPUs.
+    """
+    zstd_worker_threads.max_threads = max_threads
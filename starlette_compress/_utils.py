@@ -1,25 +1,238 @@
 from __future__ import annotations
 
 import re
-from functools import lru_cache
-
-from starlette.datastructures import Headers
+import zlib
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
-    from starlette.types import Message
+    from collections.abc import Iterable
+
+    from starlette.types import Message, Scope
+
+_encoding_aliases: dict[str, str] = {
+    'x-gzip': 'gzip',
+}
+
+
+def parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    """Parse the accept encoding header and return a mapping of encodings to their quality values.
+
+    >>> parse_accept_encoding('br;q=1.0, gzip;q=0.8, *;q=0.1')
+    {'br': 1.0, 'gzip': 0.8, '*': 0.1}
+    """
+    result: dict[str, float] = {}
+
+    for item in accept_encoding.split(','):
+        encoding, _, params = item.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        encoding = _encoding_aliases.get(encoding, encoding)
+
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() != 'q':
+                continue
+            try:
+                quality = min(max(float(value), 0.0), 1.0)
+            except ValueError:
+                # ignore malformed entries
+                quality = -1.0
+            break
+
+        if quality >= 0 and quality > result.get(encoding, -1.0):
+            result[encoding] = quality
+
+    return result
+
+
+def get_header(headers: list[tuple[bytes, bytes]], name: bytes) -> bytes | None:
+    """Get the first raw header value, or None if not present.
+
+    The header name must be lowercase, as in ASGI messages.
+    """
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def set_header(headers: list[tuple[bytes, bytes]], name: bytes, value: bytes) -> None:
+    """Set the raw header value, replacing any existing values.
+
+    The header name must be lowercase, as in ASGI messages.
+    """
+    found = False
+    i = 0
+    while i < len(headers):
+        if headers[i][0] == name:
+            if found:
+                del headers[i]
+                continue
+            headers[i] = (name, value)
+            found = True
+        i += 1
+    if not found:
+        headers.append((name, value))
+
 
-_accept_encoding_re = re.compile(r'[a-z]{2,8}')
+def add_vary_header(headers: list[tuple[bytes, bytes]], value: bytes) -> None:
+    """Append the value to the raw Vary header."""
+    for i, (name, existing) in enumerate(headers):
+        if name == b'vary':
+            headers[i] = (name, existing + b', ' + value)
+            return
+    headers.append((b'vary', value))
 
 
-@lru_cache(maxsize=128)
-def parse_accept_encoding(accept_encoding: str) -> frozenset[str]:
-    """Parse the accept encoding header and return a set of supported encodings.
+def encode_headers(
+    headers: list[tuple[bytes, bytes]],
+    encoding: bytes,
+    content_length: int | None,
+    vary: bytes = b'Accept-Encoding',
+) -> None:
+    """Update the raw response headers for the encoded representation, in a single pass.
 
-    >>> _parse_accept_encoding('br;q=1.0, gzip;q=0.8, *;q=0.1')
-    {'br', 'gzip'}
+    Sets the Content-Encoding, the Content-Length (removed if None), extends the Vary
+    header, and derives the ETag of the encoded representation.
     """
-    return frozenset(_accept_encoding_re.findall(accept_encoding))
+    result: list[tuple[bytes, bytes]] = []
+    vary_set = False
+
+    for name, value in headers:
+        if name == b'etag' and len(value) >= 2 and value[-1:] == b'"':
+            result.append((name, b'%s-%s"' % (value[:-1], encoding)))
+        elif name == b'vary' and not vary_set:
+            result.append((name, value + b', ' + vary))
+            vary_set = True
+        elif name not in {b'content-length', b'content-encoding'}:
+            result.append((name, value))
+
+    result.append((b'content-encoding', encoding))
+    if not vary_set:
+        result.append((b'vary', vary))
+    if content_length is not None:
+        result.append((b'content-length', b'%d' % content_length))
+    headers[:] = result
+
+
+def encode_not_modified_headers(
+    headers: list[tuple[bytes, bytes]],
+    encoding: bytes,
+    vary: bytes = b'Accept-Encoding',
+) -> None:
+    """Update the raw headers of a 304 response for the encoded representation.
+
+    Derives the ETag of the encoded representation and extends the Vary header,
+    so caches can freshen their stored encoded response.
+    """
+    result: list[tuple[bytes, bytes]] = []
+    vary_set = False
+
+    for name, value in headers:
+        if name == b'etag' and len(value) >= 2 and value[-1:] == b'"':
+            result.append((name, b'%s-%s"' % (value[:-1], encoding)))
+        elif name == b'vary' and not vary_set:
+            result.append((name, value + b', ' + vary))
+            vary_set = True
+        else:
+            result.append((name, value))
+
+    if not vary_set:
+        result.append((b'vary', vary))
+    headers[:] = result
+
+
+def etag_encoding_pattern(encodings: Iterable[str]) -> re.Pattern[bytes]:
+    """Compile the pattern matching the encoding suffixes of ETags."""
+    alternatives = b'|'.join(re.escape(encoding.encode()) for encoding in encodings)
+    return re.compile(rb'-(?:' + alternatives + rb')"')
+
+
+_etag_encoding_re = etag_encoding_pattern(('zstd', 'br', 'gzip', 'dcz'))
+
+
+def decode_etag_conditions(
+    scope: Scope, pattern: re.Pattern[bytes] = _etag_encoding_re
+) -> Scope:
+    """Strip the encoding suffixes from ETags in the conditional request headers.
+
+    This allows the application to match the ETags of encoded representations.
+    """
+    headers: list[tuple[bytes, bytes]] = scope['headers']
+    new_headers: list[tuple[bytes, bytes]] | None = None
+
+    for i, (name, value) in enumerate(headers):
+        if name in {b'if-none-match', b'if-match'}:
+            new_value = pattern.sub(b'"', value)
+            if new_value != value:
+                if new_headers is None:
+                    new_headers = list(headers)
+                new_headers[i] = (name, new_value)
+
+    if new_headers is None:
+        return scope
+    return {**scope, 'headers': new_headers}
+
+
+def has_encoded_etag_condition(scope: Scope, encoding: bytes) -> bool:
+    """Check if the conditional request headers refer to an ETag of the encoded representation."""
+    suffix = b'-%s"' % encoding
+    for name, value in scope['headers']:
+        if name in {b'if-none-match', b'if-match'} and suffix in value:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Iterable[str]) -> str | None:
+    """Select the best encoding for the accept encoding header, following RFC 9110.
+
+    Encodings with equal quality values are resolved by the order of the given encodings.
+    Returns None if no content coding should be applied.
+
+    >>> negotiate_encoding('gzip;q=1, br;q=0', ('zstd', 'br', 'gzip'))
+    'gzip'
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get('*', 0.0)
+    best: str | None = None
+    best_quality = 0.0
+
+    for encoding in encodings:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+
+    # identity is only preferred when explicitly ranked above all other encodings
+    if best is not None and qualities.get('identity', 0.0) > best_quality:
+        return None
+    return best
+
+
+def accepted_encodings(accept_encoding: str, encodings: Iterable[str]) -> list[str]:
+    """List the acceptable encodings for the accept encoding header, best first.
+
+    Encodings with equal quality values keep the order of the given encodings.
+    Encodings ranked below identity are omitted.
+    The first encoding is the one selected by negotiate_encoding.
+
+    >>> accepted_encodings('gzip;q=0.5, br, zstd;q=0', ('zstd', 'br', 'gzip'))
+    ['br', 'gzip']
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get('*', 0.0)
+    identity = qualities.get('identity', 0.0)
+    accepted: list[tuple[float, str]] = []
+
+    for encoding in encodings:
+        quality = qualities.get(encoding, wildcard)
+        if quality > 0 and quality >= identity:
+            accepted.append((quality, encoding))
+
+    accepted.sort(key=lambda item: item[0], reverse=True)
+    return [encoding for _, encoding in accepted]
 
 
 # Based on
@@ -100,19 +313,128 @@ def remove_compress_type(content_type: str) -> None:
     _compress_content_types.discard(content_type)
 
 
-def is_start_message_satisfied(message: Message) -> bool:
+def is_compress_type(content_type: str) -> bool:
+    """Check if the content-type (without parameters) should be compressed."""
+    return content_type in _compress_content_types
+
+
+_CONTENT_TYPE_CACHE_SIZE = 1024
+
+
+class ContentTypeMatcher:
+    __slots__ = (
+        '_cache',
+        '_pattern',
+        '_types',
+    )
+
+    def __init__(self, content_types: Iterable[str] | None = None) -> None:
+        """Matcher of compressible content-types, checked on every response.
+
+        Content-types may contain wildcards, e.g., `text/*` or `application/*+json`.
+        The matcher is frozen, and caches the decisions per Content-Type header value.
+        Without content-types, the types registered with add_compress_type are matched.
+
+        :param content_types: Compressible content-types (without parameters).
+        """
+        if content_types is None:
+            # follow the registry changes, without caching
+            self._types: set[str] | frozenset[str] = _compress_content_types
+            self._pattern: re.Pattern[str] | None = None
+            self._cache: dict[bytes, bool] | None = None
+            return
+
+        types: set[str] = set()
+        patterns: list[str] = []
+        for content_type in content_types:
+            normalized = content_type.strip().lower()
+            if '*' in normalized:
+                patterns.append('[^/]*'.join(map(re.escape, normalized.split('*'))))
+            else:
+                types.add(normalized)
+
+        self._types = frozenset(types)
+        self._pattern = re.compile('|'.join(patterns)) if patterns else None
+        self._cache = {}
+
+    def __call__(self, content_type: bytes) -> bool:
+        """Check if the Content-Type header value should be compressed."""
+        cache = self._cache
+        if cache is not None:
+            result = cache.get(content_type)
+            if result is not None:
+                return result
+
+        basic_content_type = (
+            content_type.split(b';', 1)[0].strip().lower().decode('latin-1')
+        )
+        result = basic_content_type in self._types or (
+            self._pattern is not None
+            and self._pattern.fullmatch(basic_content_type) is not None
+        )
+
+        if cache is not None:
+            if len(cache) >= _CONTENT_TYPE_CACHE_SIZE:
+                # evict the oldest entry
+                del cache[next(iter(cache))]
+            cache[content_type] = result
+        return result
+
+
+def is_start_message_satisfied(
+    message: Message, content_types: ContentTypeMatcher
+) -> bool:
     """Check if response should be compressed based on the start message."""
-    headers = Headers(raw=message['headers'])
+    content_type: bytes | None = None
+    for name, value in message['headers']:
+        lower_name = name.lower()
+        # must not already be compressed
+        if lower_name == b'content-encoding':
+            return False
+        if lower_name == b'content-type':
+            content_type = value
 
-    # must not already be compressed
-    if 'Content-Encoding' in headers:
-        return False
+    # must be a compressible content-type
+    return bool(content_type) and content_types(content_type)
 
-    # content-type header must be present
-    content_type = headers.get('Content-Type')
-    if not content_type:
+
+# trial compression sample of the incompressible body check
+_SAMPLE_SIZE = 8 * 1024
+# smaller samples are not representative
+_SAMPLE_MIN_SIZE = 1024
+
+
+def is_incompressible(body: bytes, threshold: float) -> bool:
+    """Check if the body is unlikely to compress, with a trial compression of its beginning.
+
+    The sample is compressed with raw deflate at the fastest level,
+    and the body is incompressible if the output exceeds the threshold fraction.
+    """
+    if len(body) < _SAMPLE_MIN_SIZE:
         return False
+    sample = body[:_SAMPLE_SIZE]
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed_size > len(sample) * threshold
 
-    # must be a compressible content-type
-    basic_content_type = content_type.split(';', maxsplit=1)[0].strip()
-    return basic_content_type in _compress_content_types
+
+def pop_compress_override(message: Message) -> tuple[bool, int | None]:
+    """Remove the X-Compress header from the start message, and parse its value.
+
+    The header disables compression with "off", or sets the compression level
+    of the negotiated encoding with an integer.
+
+    Returns whether compression is enabled, and the level override.
+    """
+    headers: list[tuple[bytes, bytes]] = message['headers']
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b'x-compress':
+            del headers[i]
+            override = value.strip().lower()
+            if override == b'off':
+                return False, None
+            try:
+                return True, int(override)
+            except ValueError:
+                return True, None
+    return True, None
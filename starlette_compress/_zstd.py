@@ -1,95 +1,216 @@
 from __future__ import annotations
 
-from compression.zstd import ZstdCompressor  # type: ignore
-from starlette.datastructures import MutableHeaders
-
-from starlette_compress._utils import is_start_message_satisfied
+from compression.zstd import (  # type: ignore
+    CompressionParameter,
+    ZstdCompressor,
+    ZstdDecompressor,
+    ZstdDict,
+    compress,
+    train_dict,
+)
+
+from starlette_compress._budget import context_size
+from starlette_compress._codec import Codec, StreamCompressor
+from starlette_compress._dictionary import (
+    dcz_prefix,
+    dcz_table_log,
+    dcz_window_log,
+    dictionary_hash,
+)
+from starlette_compress._threads import zstd_worker_threads
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
-    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+    from starlette_compress._offload import Offloader
+    from starlette_compress._pool import CompressorPool
+    from starlette_compress._request import Decompressor
+
+_DICT_MAGIC = b'\x37\xa4\x30\xec'
+
 
+class ZstdCodec(Codec):
+    __slots__ = (
+        'compressors',
+        'dictionary',
+        'dictionary_size',
+        'pool',
+        'threads',
+        'threads_threshold',
+    )
 
-class ZstdResponder:
+    # ZSTD_minCLevel to ZSTD_maxCLevel
+    levels = range(-(1 << 17), 23)
+
+    def __init__(
+        self,
+        level: int,
+        pool: CompressorPool[ZstdCompressor] | None,
+        threads: int,
+        threads_threshold: int,
+        dictionary: bytes | None = None,
+    ) -> None:
+        super().__init__('zstd', level)
+        self.pool = pool
+        self.threads = threads
+        self.threads_threshold = threads_threshold
+        self.dictionary_size = 0
+        if dictionary is not None:
+            # dictionary-compressed responses use the dcz encoding
+            self.encoding = 'dcz'
+            self.cache_encoding = f'dcz{dictionary_hash(dictionary)}'
+            self.prefix = dcz_prefix(dictionary)
+            self.vary = b'Accept-Encoding, Available-Dictionary'
+            self.dictionary = ZstdDict(
+                dictionary, is_raw=not dictionary.startswith(_DICT_MAGIC)
+            )
+            self.dictionary_size = len(dictionary)
+        else:
+            self.dictionary = None
+        self.compressors = {level: self._new_compressor(level)}
+
+    def with_dictionary(self, dictionary: bytes) -> ZstdCodec:
+        """Create a codec of the dcz encoding with the same options."""
+        return ZstdCodec(
+            self.level, self.pool, self.threads, self.threads_threshold, dictionary
+        )
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        if self.dictionary is None:
+            return compress(body, level=level)
+        # shared compressors are not thread-safe, use a fresh context
+        return self._new_compressor(level).compress(body, ZstdCompressor.FLUSH_FRAME)
+
+    async def compress_async(
+        self, body: bytes, level: int, offloader: Offloader | None
+    ) -> bytes:
+        threads = self.reserve_threads(len(body))
+        if threads:
+            try:
+                compressor = self._threaded_compressor(level, threads)
+                if offloader is not None and len(body) >= offloader.threshold:
+                    return await offloader(
+                        compressor.compress, body, ZstdCompressor.FLUSH_FRAME
+                    )
+                return compressor.compress(body, ZstdCompressor.FLUSH_FRAME)
+            finally:
+                zstd_worker_threads.release(threads)
+        if offloader is not None and len(body) >= offloader.threshold:
+            return await offloader(self.compress, body, level)
+        return self._compressor(level).compress(body, ZstdCompressor.FLUSH_FRAME)
+
+    def offloaded(self, size: int, offloader: Offloader | None) -> bool:
+        # multi-threaded compression runs in the worker threads of the library
+        if self.threads and size >= self.threads_threshold:
+            return True
+        return super().offloaded(size, offloader)
+
+    def compressor(self, level: int, size: int | None) -> _ZstdStream:
+        threads = self.reserve_threads(size) if size is not None else 0
+        if threads:
+            # multi-threaded contexts are not pooled
+            return _ZstdStream(
+                self, self._threaded_compressor(level, threads), level, threads
+            )
+        pool = self.pool
+        if pool is not None:
+            compressor = pool.get((self.cache_encoding, level))
+            if compressor is not None:
+                return _ZstdStream(self, compressor, level, 0)
+        return _ZstdStream(self, self._new_compressor(level), level, 0)
+
+    def context_size(self, level: int) -> int:
+        if self.dictionary is not None:
+            # the window of dictionary compression reaches back into the dictionary
+            return context_size('zstd', level) + (
+                1 << dcz_window_log(self.dictionary_size)
+            )
+        return context_size('zstd', level)
+
+    def reserve_threads(self, size: int) -> int:
+        """Reserve worker threads for a body of the given size, 0 if single-threaded."""
+        if self.threads and size >= self.threads_threshold:
+            return zstd_worker_threads.acquire(self.threads)
+        return 0
+
+    def _threaded_compressor(self, level: int, threads: int) -> ZstdCompressor:
+        return self._new_compressor(level, threads)
+
+    def _compressor(self, level: int) -> ZstdCompressor:
+        compressor = self.compressors.get(level)
+        if compressor is None:
+            compressor = self._new_compressor(level)
+            self.compressors[level] = compressor
+        return compressor
+
+    def _new_compressor(self, level: int, threads: int = 0) -> ZstdCompressor:
+        dictionary = self.dictionary
+        if dictionary is None:
+            if not threads:
+                return ZstdCompressor(level)
+            options = {
+                CompressionParameter.compression_level: level,
+                CompressionParameter.nb_workers: threads,
+            }
+            return ZstdCompressor(options=options)
+
+        # dictionary compression, reaching back into large dictionaries
+        size = self.dictionary_size
+        options = {
+            CompressionParameter.compression_level: level,
+            CompressionParameter.window_log: dcz_window_log(size),
+        }
+        if threads:
+            options[CompressionParameter.nb_workers] = threads
+        table_log = dcz_table_log(size)
+        if table_log is None:
+            return ZstdCompressor(options=options, zstd_dict=dictionary)
+        # digested dictionaries use the tables of the level, load it with larger ones
+        options[CompressionParameter.hash_log] = table_log
+        options[CompressionParameter.chain_log] = table_log
+        return ZstdCompressor(options=options, zstd_dict=dictionary.as_undigested_dict)
+
+
+class _ZstdStream(StreamCompressor):
     __slots__ = (
-        'app',
+        'codec',
         'compressor',
         'level',
-        'minimum_size',
+        'threads',
     )
 
-    def __init__(self, app: ASGIApp, minimum_size: int, level: int) -> None:
-        self.app = app
-        self.minimum_size = minimum_size
+    def __init__(
+        self, codec: ZstdCodec, compressor: ZstdCompressor, level: int, threads: int
+    ) -> None:
+        self.codec = codec
+        self.compressor = compressor
         self.level = level
-        self.compressor = ZstdCompressor(level)
+        self.threads = threads
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        start_message: Message | None = None
-        chunker: ZstdCompressor | None = None
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
 
-        async def wrapper(message: Message) -> None:
-            nonlocal start_message, chunker
+    def flush(self) -> bytes:
+        return self.compressor.flush(ZstdCompressor.FLUSH_BLOCK)
 
-            message_type: str = message['type']
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+    def close(self) -> None:
+        """Return the context to the pool, or release its worker threads."""
+        if self.threads:
+            zstd_worker_threads.release(self.threads)
+            self.threads = 0
+            return
+        pool = self.codec.pool
+        # an unfinished frame cannot be discarded, drop the compressor
+        if pool is not None and self.compressor.last_mode == ZstdCompressor.FLUSH_FRAME:
+            pool.put((self.codec.cache_encoding, self.level), self.compressor)
+
+
+def train_dictionary(samples: list[bytes], size: int) -> bytes:
+    return train_dict(samples, size).dict_content
 
-            # handle start message
-            if message_type == 'http.response.start':
-                if start_message is not None:
-                    raise AssertionError(
-                        'Unexpected repeated http.response.start message'
-                    )
 
-                if is_start_message_satisfied(message):
-                    # capture start message and wait for response body
-                    start_message = message
-                    return
-                else:
-                    await send(message)
-                    return
-
-            # skip if start message is not satisfied or unknown message type
-            if start_message is None or message_type != 'http.response.body':
-                await send(message)
-                return
-
-            body: bytes = message.get('body', b'')
-            more_body: bool = message.get('more_body', False)
-
-            if chunker is None:
-                # skip compression for small responses
-                if not more_body and len(body) < self.minimum_size:
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                headers = MutableHeaders(raw=start_message['headers'])
-                headers['Content-Encoding'] = 'zstd'
-                headers.add_vary_header('Accept-Encoding')
-
-                if not more_body:
-                    # one-shot
-                    compressed_body = self.compressor.compress(body, 2)
-                    headers['Content-Length'] = str(len(compressed_body))
-                    message['body'] = compressed_body
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                # begin streaming
-                del headers['Content-Length']
-                await send(start_message)
-                chunker = ZstdCompressor(self.level)
-
-            # streaming
-            chunk = chunker.compress(body)  # type: ignore
-            if chunk:
-                await send(
-                    {'type': 'http.response.body', 'body': chunk, 'more_body': True}
-                )
-            if more_body:
-                return
-            chunk = chunker.flush()  # type: ignore
-            await send({'type': 'http.response.body', 'body': chunk})
-
-        await self.app(scope, receive, wrapper)
+def decompressor() -> Decompressor:
+    """Create an incremental decompressor for request bodies."""
+    return ZstdDecompressor()
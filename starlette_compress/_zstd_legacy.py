@@ -1,100 +1,240 @@
 from __future__ import annotations
 
-from starlette.datastructures import MutableHeaders
-from zstandard import ZstdCompressor  # type: ignore
-
-from starlette_compress._utils import is_start_message_satisfied
+from zstandard import (  # type: ignore
+    ZstdCompressionDict,
+    ZstdCompressionParameters,
+    ZstdCompressor,
+    ZstdDecompressor,
+    train_dictionary as zstd_train_dictionary,
+)
+
+from starlette_compress._budget import context_size
+from starlette_compress._codec import Codec, StreamCompressor
+from starlette_compress._dictionary import (
+    dcz_prefix,
+    dcz_table_log,
+    dcz_window_log,
+    dictionary_hash,
+)
+from starlette_compress._threads import zstd_worker_threads
 
 TYPE_CHECKING = False
 if TYPE_CHECKING:
-    from starlette.types import ASGIApp, Message, Receive, Scope, Send
-    from zstandard import ZstdCompressionChunker  # type: ignore
+    from starlette_compress._offload import Offloader
+    from starlette_compress._pool import CompressorPool
+    from starlette_compress._request import Decompressor
+
+# a block decompresses to at most 128 KiB, and takes at least 3 bytes of input
+_BLOCK_MAX_SIZE = 128 * 1024
+
 
+class ZstdCodec(Codec):
+    __slots__ = (
+        'compressors',
+        'dictionary',
+        'dictionary_size',
+        'pool',
+        'threads',
+        'threads_threshold',
+    )
 
-class ZstdResponder:
+    # ZSTD_minCLevel to ZSTD_maxCLevel
+    levels = range(-(1 << 17), 23)
+
+    def __init__(
+        self,
+        level: int,
+        pool: CompressorPool[ZstdCompressor] | None,
+        threads: int,
+        threads_threshold: int,
+        dictionary: bytes | None = None,
+    ) -> None:
+        super().__init__('zstd', level)
+        self.pool = pool
+        self.threads = threads
+        self.threads_threshold = threads_threshold
+        self.dictionary_size = 0
+        if dictionary is not None:
+            # dictionary-compressed responses use the dcz encoding
+            self.encoding = 'dcz'
+            self.cache_encoding = f'dcz{dictionary_hash(dictionary)}'
+            self.prefix = dcz_prefix(dictionary)
+            self.vary = b'Accept-Encoding, Available-Dictionary'
+            self.dictionary = ZstdCompressionDict(dictionary)
+            self.dictionary_size = len(dictionary)
+            self.dictionary.precompute_compress(
+                compression_params=self._parameters(level, 0)
+            )
+        else:
+            self.dictionary = None
+        self.compressors = {level: self._new_compressor(level)}
+
+    def with_dictionary(self, dictionary: bytes) -> ZstdCodec:
+        """Create a codec of the dcz encoding with the same options."""
+        return ZstdCodec(
+            self.level, self.pool, self.threads, self.threads_threshold, dictionary
+        )
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        # shared compressors are not thread-safe, use a fresh context
+        return self._new_compressor(level).compress(body)
+
+    async def compress_async(
+        self, body: bytes, level: int, offloader: Offloader | None
+    ) -> bytes:
+        threads = self.reserve_threads(len(body))
+        if threads:
+            try:
+                compress_threaded = self._threaded_compressor(level, threads).compress
+                if offloader is not None and len(body) >= offloader.threshold:
+                    return await offloader(compress_threaded, body)
+                return compress_threaded(body)
+            finally:
+                zstd_worker_threads.release(threads)
+        if offloader is not None and len(body) >= offloader.threshold:
+            return await offloader(self.compress, body, level)
+        return self._compressor(level).compress(body)
+
+    def offloaded(self, size: int, offloader: Offloader | None) -> bool:
+        # multi-threaded compression runs in the worker threads of the library
+        if self.threads and size >= self.threads_threshold:
+            return True
+        return super().offloaded(size, offloader)
+
+    def compressor(self, level: int, size: int | None) -> _ZstdStream:
+        threads = self.reserve_threads(size) if size is not None else 0
+        if threads:
+            # multi-threaded contexts are not pooled
+            context = self._threaded_compressor(level, threads)
+        else:
+            context = None
+            pool = self.pool
+            if pool is not None:
+                context = pool.get((self.cache_encoding, level))
+            if context is None:
+                context = self._new_compressor(level)
+        return _ZstdStream(
+            self, context, level, threads, size if size is not None else -1
+        )
+
+    def context_size(self, level: int) -> int:
+        if self.dictionary is not None:
+            # the window of dictionary compression reaches back into the dictionary
+            return context_size('zstd', level) + (
+                1 << dcz_window_log(self.dictionary_size)
+            )
+        return context_size('zstd', level)
+
+    def reserve_threads(self, size: int) -> int:
+        """Reserve worker threads for a body of the given size, 0 if single-threaded."""
+        if self.threads and size >= self.threads_threshold:
+            return zstd_worker_threads.acquire(self.threads)
+        return 0
+
+    def _threaded_compressor(self, level: int, threads: int) -> ZstdCompressor:
+        return self._new_compressor(level, threads)
+
+    def _compressor(self, level: int) -> ZstdCompressor:
+        compressor = self.compressors.get(level)
+        if compressor is None:
+            compressor = self._new_compressor(level)
+            self.compressors[level] = compressor
+        return compressor
+
+    def _new_compressor(self, level: int, threads: int = 0) -> ZstdCompressor:
+        if self.dictionary is None:
+            return ZstdCompressor(level=level, threads=threads)
+        return ZstdCompressor(
+            compression_params=self._parameters(level, threads),
+            dict_data=self.dictionary,
+        )
+
+    def _parameters(self, level: int, threads: int) -> ZstdCompressionParameters:
+        """Parameters of dictionary compression, reaching back into large dictionaries."""
+        size = self.dictionary_size
+        options = {'window_log': dcz_window_log(size), 'threads': threads}
+        table_log = dcz_table_log(size)
+        if table_log is not None:
+            defaults = ZstdCompressionParameters.from_level(level)
+            options['hash_log'] = max(defaults.hash_log, table_log)
+            options['chain_log'] = max(defaults.chain_log, table_log)
+        return ZstdCompressionParameters.from_level(level, **options)
+
+
+class _ZstdStream(StreamCompressor):
     __slots__ = (
-        'app',
-        'compressor',
+        'chunker',
+        'codec',
+        'context',
         'level',
-        'minimum_size',
+        'threads',
     )
 
-    def __init__(self, app: ASGIApp, minimum_size: int, level: int) -> None:
-        self.app = app
-        self.minimum_size = minimum_size
+    def __init__(
+        self,
+        codec: ZstdCodec,
+        context: ZstdCompressor,
+        level: int,
+        threads: int,
+        size: int,
+    ) -> None:
+        self.codec = codec
+        self.context = context
         self.level = level
-        self.compressor = ZstdCompressor(level=level)
-
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        start_message: Message | None = None
-        chunker: ZstdCompressionChunker | None = None
-
-        async def wrapper(message: Message) -> None:
-            nonlocal start_message, chunker
-
-            message_type: str = message['type']
-
-            # handle start message
-            if message_type == 'http.response.start':
-                if start_message is not None:
-                    raise AssertionError(
-                        'Unexpected repeated http.response.start message'
-                    )
-
-                if is_start_message_satisfied(message):
-                    # capture start message and wait for response body
-                    start_message = message
-                    return
-                else:
-                    await send(message)
-                    return
-
-            # skip if start message is not satisfied or unknown message type
-            if start_message is None or message_type != 'http.response.body':
-                await send(message)
-                return
-
-            body: bytes = message.get('body', b'')
-            more_body: bool = message.get('more_body', False)
-
-            if chunker is None:
-                # skip compression for small responses
-                if not more_body and len(body) < self.minimum_size:
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                headers = MutableHeaders(raw=start_message['headers'])
-                headers['Content-Encoding'] = 'zstd'
-                headers.add_vary_header('Accept-Encoding')
-
-                if not more_body:
-                    # one-shot
-                    compressed_body = self.compressor.compress(body)
-                    headers['Content-Length'] = str(len(compressed_body))
-                    message['body'] = compressed_body
-                    await send(start_message)
-                    await send(message)
-                    return
-
-                # begin streaming
-                content_length: int = int(headers.get('Content-Length', -1))
-                del headers['Content-Length']
-                await send(start_message)
-                chunker = ZstdCompressor(level=self.level).chunker(content_length)
-
-            # streaming
-            for chunk in chunker.compress(body):  # type: ignore
-                await send(
-                    {'type': 'http.response.body', 'body': chunk, 'more_body': True}
-                )
-            if more_body:
-                return
-            for chunk in chunker.finish():  # type: ignore
-                await send(
-                    {'type': 'http.response.body', 'body': chunk, 'more_body': True}
-                )
-
-            await send({'type': 'http.response.body'})
-
-        await self.app(scope, receive, wrapper)
+        self.threads = threads
+        # creating a chunker resets the context
+        self.chunker = context.chunker(size)
+
+    def compress(self, data: bytes) -> bytes:
+        return b''.join(self.chunker.compress(data))
+
+    def flush(self) -> bytes:
+        return b''.join(self.chunker.flush())
+
+    def finish(self) -> bytes:
+        return b''.join(self.chunker.finish())
+
+    def close(self) -> None:
+        """Return the context to the pool, or release its worker threads."""
+        if self.threads:
+            zstd_worker_threads.release(self.threads)
+            self.threads = 0
+            return
+        pool = self.codec.pool
+        if pool is not None:
+            pool.put((self.codec.cache_encoding, self.level), self.context)
+
+
+def train_dictionary(samples: list[bytes], size: int) -> bytes:
+    return zstd_train_dictionary(size, samples).as_bytes()  # type: ignore
+
+
+class _ZstdDecompressor:
+    __slots__ = ('_decompressobj',)
+
+    def __init__(self) -> None:
+        self._decompressobj = ZstdDecompressor().decompressobj()
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressobj.eof
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        # output limit is not supported, bound it by feeding the input in slices
+        decompress = self._decompressobj.decompress
+        view = memoryview(data)
+        chunks: list[bytes] = []
+        size = 0
+        while view and size < max_length:
+            # a slice completes at most step / 3 + 1 blocks
+            step = 3 * ((max_length - size) // _BLOCK_MAX_SIZE + 1)
+            chunk = decompress(view[:step])
+            chunks.append(chunk)
+            size += len(chunk)
+            view = view[step:]
+        return b''.join(chunks)
+
+
+def decompressor() -> Decompressor:
+    """Create an incremental decompressor for request bodies."""
+    return _ZstdDecompressor()
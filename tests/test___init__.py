@@ -1,7 +1,16 @@
+import base64
+import gzip
+import hashlib
+import json
 import random
 import sys
+import zlib
+from collections.abc import Sequence
+from itertools import product
+from pathlib import Path
 from typing import Callable
 
+import anyio
 import pytest
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
@@ -11,16 +20,75 @@ from starlette.responses import (
     Response,
     StreamingResponse,
 )
-from starlette.routing import Route
+from starlette.routing import Mount, Route
 from starlette.testclient import TestClient
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Scope
 
 from starlette_compress import (
+    CompressCache,
     CompressMiddleware,
+    CompressRecord,
+    CompressStaticFiles,
+    DeflateCodec,
+    DictionaryStore,
+    GzipCodec,
+    MemoryBudget,
     add_compress_type,
+    precompress_directory,
     remove_compress_type,
+    train_zstd_dictionary,
 )
-from starlette_compress._utils import parse_accept_encoding
+from starlette_compress._adaptive import AdaptiveLevel
+from starlette_compress._brotli import brotli
+from starlette_compress._pool import CompressorPool
+from starlette_compress._request import _decompressor
+from starlette_compress._threads import WorkerThreads, zstd_worker_threads
+from starlette_compress._utils import (
+    ContentTypeMatcher,
+    accepted_encodings,
+    decode_etag_conditions,
+    encode_headers,
+    etag_encoding_pattern,
+    negotiate_encoding,
+    parse_accept_encoding,
+)
+
+if sys.version_info < (3, 14):
+    from zstandard import (
+        DICT_TYPE_RAWCONTENT,
+        ZstdCompressionDict,
+        ZstdCompressor,
+        ZstdDecompressor,
+    )
+
+    zstd_compress = ZstdCompressor().compress
+
+    def zstd_decompress_delta(data: bytes, dictionary: bytes, window_log_max: int):
+        return (
+            ZstdDecompressor(
+                dict_data=ZstdCompressionDict(
+                    dictionary, dict_type=DICT_TYPE_RAWCONTENT
+                ),
+                max_window_size=1 << window_log_max,
+            )
+            .decompressobj()
+            .decompress(data)
+        )
+else:
+    from compression.zstd import (
+        DecompressionParameter,
+        ZstdDict,
+        compress as zstd_compress,
+        decompress as zstd_decompress,
+    )
+
+    def zstd_decompress_delta(data: bytes, dictionary: bytes, window_log_max: int):
+        return zstd_decompress(
+            data,
+            zstd_dict=ZstdDict(dictionary, is_raw=True),
+            options={DecompressionParameter.window_log_max: window_log_max},
+        )
+
 
 TestClientFactory = Callable[[ASGIApp], TestClient]
 
@@ -55,6 +123,210 @@ def test_compress_responses(test_client_factory: TestClientFactory):
         assert response.headers['Vary'] == 'Accept-Encoding'
 
 
+def test_compress_offloaded_responses(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[
+            Middleware(
+                CompressMiddleware, offload_threshold=1000, offload_max_threads=2
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br', 'zstd'):
+        response = client.get('/', headers={'accept-encoding': encoding})
+        assert response.status_code == 200
+
+        try:
+            assert response.text == 'x' * 4000
+        except AssertionError:
+            # TODO: remove after new zstd support in httpx
+            if encoding != 'zstd' or sys.version_info < (3, 14):
+                raise
+            from compression import zstd
+
+            assert zstd.decompress(response.content) == b'x' * 4000
+
+        assert response.headers['Content-Encoding'] == encoding
+        assert int(response.headers['Content-Length']) < 4000
+
+
+def test_compress_cached_responses(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    cache = CompressCache()
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, cache=cache)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br', 'zstd'):
+        for _ in range(2):
+            response = client.get('/', headers={'accept-encoding': encoding})
+            assert response.status_code == 200
+
+            try:
+                assert response.text == 'x' * 4000
+            except AssertionError:
+                # TODO: remove after new zstd support in httpx
+                if encoding != 'zstd' or sys.version_info < (3, 14):
+                    raise
+                from compression import zstd
+
+                assert zstd.decompress(response.content) == b'x' * 4000
+
+            assert response.headers['Content-Encoding'] == encoding
+            assert int(response.headers['Content-Length']) < 4000
+
+    assert len(cache) == 3
+    assert cache.hits == 3
+    assert cache.misses == 3
+
+
+def test_compress_cache_eviction():
+    cache = CompressCache(max_size=10)
+    keys = [CompressCache.key(str(i).encode(), 'gzip', 4) for i in range(3)]
+    cache.put(keys[0], b'x' * 4)
+    cache.put(keys[1], b'x' * 4)
+    assert cache.get(keys[0]) == b'x' * 4
+    cache.put(keys[2], b'x' * 4)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.size == 8
+    cache.put(keys[1], b'x' * 11)
+    assert cache.get(keys[1]) is None
+    assert cache.hits == 3
+    assert cache.misses == 2
+
+
+def test_compress_etag_responses(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse(
+            'x' * 4000, status_code=200, headers={'ETag': request.query_params['etag']}
+        )
+
+    cache = CompressCache()
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, cache=cache)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br'):
+        for _ in range(2):
+            response = client.get('/?etag="abc"', headers={'accept-encoding': encoding})
+            assert response.status_code == 200
+            assert response.text == 'x' * 4000
+            assert response.headers['Content-Encoding'] == encoding
+            assert int(response.headers['Content-Length']) < 4000
+            assert response.headers['ETag'] == f'"abc-{encoding}"'
+            assert response.headers['Vary'] == 'Accept-Encoding'
+
+        response = client.get('/?etag=W/"abc"', headers={'accept-encoding': encoding})
+        assert response.headers['ETag'] == f'W/"abc-{encoding}"'
+
+    # per encoding: etag and body misses, then etag hit, then body hit (weak etag)
+    assert cache.hits == 4
+    assert cache.misses == 4
+
+
+def test_compress_etag_responses_per_resource(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse(request.url.path * 1000, headers={'ETag': '"1"'})
+
+    cache = CompressCache()
+    app = Starlette(
+        routes=[Route('/a', endpoint=homepage), Route('/b', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, cache=cache)],
+    )
+
+    client = test_client_factory(app)
+
+    # resources with the same etag do not share cached bodies
+    for path in ('/a', '/b', '/a', '/b?q=1'):
+        response = client.get(path, headers={'accept-encoding': 'gzip'})
+        assert response.text == path.split('?')[0] * 1000
+        assert response.headers['ETag'] == '"1-gzip"'
+
+
+def test_compress_etag_responses_per_user(test_client_factory: TestClientFactory):
+    def me(request: Request) -> PlainTextResponse:
+        return PlainTextResponse(
+            request.cookies['user'] * 1000,
+            headers={
+                'ETag': '"1"',
+                'Vary': request.query_params['vary'],
+                'Cache-Control': request.query_params['cache_control'],
+            },
+        )
+
+    cache = CompressCache()
+    app = Starlette(
+        routes=[Route('/me', endpoint=me)],
+        middleware=[Middleware(CompressMiddleware, cache=cache)],
+    )
+
+    client = test_client_factory(app)
+
+    for query in (
+        '?vary=Cookie&cache_control=private',
+        '?vary=Accept-Encoding&cache_control=no-store',
+        '?vary=*&cache_control=max-age=60',
+        '?vary=Accept-Encoding, Cookie&cache_control=max-age=60',
+    ):
+        for user in ('alice', 'bob', 'alice', 'bob'):
+            client.cookies = {'user': user}
+            response = client.get('/me' + query, headers={'accept-encoding': 'gzip'})
+            assert response.status_code == 200
+            assert response.text == user * 1000
+
+
+def test_compress_etag_revalidation(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> Response:
+        if request.headers.get('if-none-match') == '"v"':
+            return Response(status_code=304, headers={'ETag': '"v"'})
+        return PlainTextResponse('x' * 4000, headers={'ETag': '"v"'})
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br'):
+        response = client.get('/', headers={'accept-encoding': encoding})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert etag == f'"v-{encoding}"'
+
+        # the 304 response carries the validator of the stored encoded response
+        response = client.get(
+            '/', headers={'accept-encoding': encoding, 'if-none-match': etag}
+        )
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert response.headers['Vary'] == 'Accept-Encoding'
+
+    # unencoded representations are revalidated unchanged
+    for accept_encoding in ('identity', 'gzip'):
+        response = client.get(
+            '/', headers={'accept-encoding': accept_encoding, 'if-none-match': '"v"'}
+        )
+        assert response.status_code == 304
+        assert response.headers['ETag'] == '"v"'
+
+
 def test_compress_not_in_accept_encoding(test_client_factory: TestClientFactory):
     def homepage(request: Request) -> PlainTextResponse:
         return PlainTextResponse('x' * 4000, status_code=200)
@@ -141,6 +413,32 @@ def test_compress_streaming_response(
         assert response.headers['Vary'] == 'Accept-Encoding'
 
 
+def test_compress_gzip_streaming_buffers(test_client_factory: TestClientFactory):
+    async def app(scope, receive, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/plain')],
+            }
+        )
+        data = b'x' * 1000
+        await send(
+            {'type': 'http.response.body', 'body': bytearray(data), 'more_body': True}
+        )
+        await send(
+            {'type': 'http.response.body', 'body': memoryview(data), 'more_body': True}
+        )
+        await send({'type': 'http.response.body', 'body': data})
+
+    client = test_client_factory(CompressMiddleware(app))
+    response = client.get('/', headers={'accept-encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.text == 'x' * 3000
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+
 def test_compress_ignored_for_responses_with_encoding_set(
     test_client_factory: TestClientFactory,
 ):
@@ -249,7 +547,1217 @@ def test_compress_registered_content_type(test_client_factory: TestClientFactory
         assert 'Vary' not in response.headers
 
 
-def test_parse_accept_encoding():
-    assert parse_accept_encoding('') == frozenset()
-    assert parse_accept_encoding('gzip, deflate') == {'gzip', 'deflate'}
-    assert parse_accept_encoding('br;q=1.0,gzip;q=0.8, *;q=0.1') == {'br', 'gzip'}
+def test_compress_respects_quality_values(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware)],
+    )
+
+    client = test_client_factory(app)
+
+    for accept_encoding, encoding in (
+        ('gzip;q=1, br;q=0', 'gzip'),
+        ('gzip;q=0.5, br;q=0.8', 'br'),
+        ('zstd;q=0, *', 'br'),
+        ('x-gzip', 'gzip'),
+        ('gzip;q=0.5, identity', None),
+        ('*;q=0', None),
+    ):
+        response = client.get('/', headers={'accept-encoding': accept_encoding})
+        assert response.status_code == 200
+        assert response.headers.get('Content-Encoding') == encoding
+        assert response.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_compress_server_preference(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, preference=('gzip', 'br'))],
+    )
+
+    client = test_client_factory(app)
+
+    for accept_encoding, encoding in (
+        ('zstd, br, gzip', 'gzip'),
+        ('zstd, br', 'br'),
+        ('zstd', 'zstd'),
+        ('gzip;q=0.5, zstd', 'zstd'),
+    ):
+        response = client.get('/', headers={'accept-encoding': accept_encoding})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == encoding
+
+    with pytest.raises(ValueError, match='Unsupported encoding'):
+        CompressMiddleware(app, preference=('deflate',))
+
+
+def test_compress_selector(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> Response:
+        params = request.query_params
+        return Response(
+            'x' * int(params['size']), media_type=params.get('type', 'text/plain')
+        )
+
+    calls = []
+
+    def selector(encodings: Sequence[str], scope: Scope, content_type, content_length):
+        calls.append((tuple(encodings), content_type, content_length))
+        if scope['path'] == '/invalid':
+            return 'deflate', None
+        if content_length > 100_000:
+            return None
+        if content_length > 10_000:
+            return 'gzip', 1
+        return encodings[0], None
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage), Route('/invalid', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, selector=selector)],
+    )
+
+    client = test_client_factory(app)
+
+    # the choice depends on the body size, known when the response starts
+    for size, accept_encoding, encoding, level in (
+        (4000, 'gzip, br, zstd', 'zstd', None),
+        (4000, 'gzip;q=0.5, br', 'br', None),
+        (20_000, 'gzip, br, zstd', 'gzip', 1),
+        (200_000, 'gzip, br, zstd', None, None),
+    ):
+        response = client.get(
+            f'/?size={size}', headers={'accept-encoding': accept_encoding}
+        )
+        assert response.status_code == 200
+        assert response.text == 'x' * size
+        assert response.headers.get('Content-Encoding') == encoding
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        if level is not None:
+            compressed = gzip.compress(b'x' * size, level, mtime=0)
+            assert int(response.headers['Content-Length']) == len(compressed)
+    assert calls == [
+        (('zstd', 'br', 'gzip'), 'text/plain; charset=utf-8', 4000),
+        (('br', 'gzip'), 'text/plain; charset=utf-8', 4000),
+        (('zstd', 'br', 'gzip'), 'text/plain; charset=utf-8', 20_000),
+        (('zstd', 'br', 'gzip'), 'text/plain; charset=utf-8', 200_000),
+    ]
+
+    # not called for ineligible responses or without acceptable encodings
+    calls.clear()
+    response = client.get('/?size=4000', headers={'accept-encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    response = client.get(
+        '/?size=4000&type=image/png', headers={'accept-encoding': 'gzip'}
+    )
+    assert 'Content-Encoding' not in response.headers
+    assert calls == []
+
+    with pytest.raises(ValueError, match='not accepted'):
+        client.get('/invalid?size=4000', headers={'accept-encoding': 'gzip'})
+
+
+def test_compress_static_files(test_client_factory: TestClientFactory, tmp_path: Path):
+    (tmp_path / 'app.js').write_text('x' * 4000)
+    (tmp_path / 'app.css').write_text('y' * 4000)
+    precompress_directory(tmp_path, zstd=False)
+    (tmp_path / 'app.css.br').unlink()
+
+    assert (tmp_path / 'app.js.gz').is_file()
+    assert not (tmp_path / 'app.js.zst').exists()
+
+    app = Starlette(
+        routes=[Mount('/static', app=CompressStaticFiles(directory=tmp_path))],
+        middleware=[Middleware(CompressMiddleware)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br'):
+        response = client.get('/static/app.js', headers={'accept-encoding': encoding})
+        assert response.status_code == 200
+        assert response.text == 'x' * 4000
+        assert response.headers['Content-Encoding'] == encoding
+        assert 'javascript' in response.headers['Content-Type']
+        assert response.headers['Vary'] == 'Accept-Encoding'
+
+        response = client.get(
+            '/static/app.js',
+            headers={
+                'accept-encoding': encoding,
+                'if-none-match': response.headers['ETag'],
+            },
+        )
+        assert response.status_code == 304
+
+    # missing sidecar is compressed by the middleware
+    response = client.get('/static/app.css', headers={'accept-encoding': 'br'})
+    assert response.status_code == 200
+    assert response.text == 'y' * 4000
+    assert response.headers['Content-Encoding'] == 'br'
+
+
+def test_compress_zstd_dictionary(test_client_factory: TestClientFactory):
+    rng = random.Random(42)  # noqa: S311
+    samples = [
+        json.dumps(
+            {
+                'id': i,
+                'name': f'user{rng.getrandbits(32)}',
+                'email': f'user{rng.getrandbits(32)}@example.com',
+                'roles': rng.sample(['admin', 'editor', 'viewer', 'owner'], k=2),
+                'active': rng.random() < 0.5,
+            }
+        ).encode()
+        * 8
+        for i in range(1000)
+    ]
+    dictionary = train_zstd_dictionary(samples, 4096)
+    dictionary_hash = (
+        f':{base64.b64encode(hashlib.sha256(dictionary).digest()).decode()}:'
+    )
+
+    def homepage(request: Request) -> Response:
+        return Response(samples[0], status_code=200, media_type='application/json')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, zstd_dictionary=dictionary)],
+    )
+
+    client = test_client_factory(app)
+
+    response = client.get(
+        '/',
+        headers={
+            'accept-encoding': 'dcz, zstd',
+            'available-dictionary': dictionary_hash,
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'dcz'
+    assert response.headers['Vary'] == 'Accept-Encoding, Available-Dictionary'
+    content = response.content
+    assert content[:40] == (
+        b'\x5e\x2a\x4d\x18\x20\x00\x00\x00' + hashlib.sha256(dictionary).digest()
+    )
+    assert int(response.headers['Content-Length']) == len(content)
+
+    if sys.version_info < (3, 14):
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary)
+        )
+        assert decompressor.decompress(content[40:]) == samples[0]
+    else:
+        from compression import zstd
+
+        assert (
+            zstd.decompress(content[40:], zstd_dict=zstd.ZstdDict(dictionary))
+            == samples[0]
+        )
+
+    # unknown dictionary
+    response = client.get(
+        '/',
+        headers={'accept-encoding': 'dcz, gzip', 'available-dictionary': ':AAAA:'},
+    )
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_compress_dictionary_store_large(test_client_factory: TestClientFactory):
+    rng = random.Random(42)  # noqa: S311
+    v1 = rng.getrandbits(8 * 1_500_000).to_bytes(1_500_000, 'big').hex().encode()
+    v2 = v1[:1_500_000] + b'0123456789' + v1[1_500_010:]
+    v1_hash = f':{base64.b64encode(hashlib.sha256(v1).digest()).decode()}:'
+
+    def homepage(request: Request) -> Response:
+        body = v1 if request.path_params['version'] == 'v1' else v2
+        headers = {'Use-As-Dictionary': 'match="/app.*.js"'}
+        if 'stream' in request.query_params:
+
+            async def generator():
+                for i in range(0, len(body), 64 * 1024):
+                    yield body[i : i + 64 * 1024]
+
+            return StreamingResponse(
+                generator(), media_type='text/javascript', headers=headers
+            )
+        return Response(body, media_type='text/javascript', headers=headers)
+
+    app = Starlette(
+        routes=[Route('/app.{version}.js', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, dictionary_store=DictionaryStore())],
+    )
+
+    client = test_client_factory(app)
+    client.get('/app.v1.js', headers={'accept-encoding': 'dcz'})
+
+    # the window reaches back to the start of the dictionary
+    for query in ('', '?stream'):
+        response = client.get(
+            f'/app.v2.js{query}',
+            headers={'accept-encoding': 'dcz', 'available-dictionary': v1_hash},
+        )
+        assert response.headers['Content-Encoding'] == 'dcz'
+        content = response.content
+        assert len(content) < 10_000
+        # dcz clients support windows of 8 MB for dictionaries up to 6.4 MB
+        assert zstd_decompress_delta(content[40:], v1, 23) == v2
+
+
+def test_compress_dictionary_store(test_client_factory: TestClientFactory):
+    rng = random.Random(42)  # noqa: S311
+    v1 = rng.getrandbits(8 * 50_000).to_bytes(50_000, 'big').hex().encode()
+    v2 = v1[:50_000] + b'changed' + v1[50_000:]
+    v1_hash = f':{base64.b64encode(hashlib.sha256(v1).digest()).decode()}:'
+
+    def homepage(request: Request) -> Response:
+        body = v1 if request.path_params['version'] == 'v1' else v2
+        return Response(
+            body,
+            status_code=200,
+            media_type='text/javascript',
+            headers={'Use-As-Dictionary': 'match="/app.*.js"'},
+        )
+
+    class CountingStore(DictionaryStore):
+        lookups = 0
+
+        def get(self, key: str):
+            self.lookups += 1
+            return super().get(key)
+
+    store = CountingStore()
+    app = Starlette(
+        routes=[Route('/app.{version}.js', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, dictionary_store=store)],
+    )
+
+    client = test_client_factory(app)
+
+    response = client.get('/app.v1.js', headers={'accept-encoding': 'br, dcz'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.content == v1
+    assert len(store) == 1
+
+    response = client.get(
+        '/app.v2.js',
+        headers={'accept-encoding': 'br, dcz', 'available-dictionary': v1_hash},
+    )
+    assert response.headers['Content-Encoding'] == 'dcz'
+    assert response.headers['Vary'] == 'Accept-Encoding, Available-Dictionary'
+    content = response.content
+    assert len(content) < 1000
+    assert content[8:40] == hashlib.sha256(v1).digest()
+
+    if sys.version_info < (3, 14):
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(
+                v1, dict_type=zstandard.DICT_TYPE_RAWCONTENT
+            )
+        )
+        assert decompressor.decompress(content[40:]) == v2
+    else:
+        from compression import zstd
+
+        assert (
+            zstd.decompress(content[40:], zstd_dict=zstd.ZstdDict(v1, is_raw=True))
+            == v2
+        )
+    assert len(store) == 2
+
+    # the responder of the stored dictionary is reused
+    for _ in range(2):
+        response = client.get(
+            '/app.v2.js',
+            headers={'accept-encoding': 'br, dcz', 'available-dictionary': v1_hash},
+        )
+        assert response.content == content
+    assert store.lookups == 1
+
+
+def test_compress_adaptive_level(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, adaptive_budget=0)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br'):
+        for _ in range(5):
+            response = client.get('/', headers={'accept-encoding': encoding})
+            assert response.status_code == 200
+            assert response.text == 'x' * 4000
+            assert response.headers['Content-Encoding'] == encoding
+
+
+def test_adaptive_level():
+    adaptive = AdaptiveLevel(budget=0.5, min_level=1, max_level=4, window=0)
+    assert adaptive.level(4) == 4
+    adaptive.record(1)
+    assert adaptive.level(4) == 3
+    adaptive.record(1)
+    adaptive.record(1)
+    adaptive.record(1)
+    assert adaptive.level(4) == 1
+    assert adaptive.level(0) == 0
+    adaptive.record(0)
+    assert adaptive.level(4) == 2
+
+
+def test_compress_flush_size(test_client_factory: TestClientFactory):
+    chunks = [f'{{"id": {i}}}\n'.encode() for i in range(5)]
+    sent: list[bytes] = []
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'application/json')],
+            }
+        )
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+
+    async def record(scope, receive, send):
+        async def wrapper(message):
+            if message['type'] == 'http.response.body':
+                sent.append(message.get('body', b''))
+            await send(message)
+
+        await middleware(scope, receive, wrapper)
+
+    middleware = CompressMiddleware(app, flush_size=0)
+    client = test_client_factory(record)
+    response = client.get('/', headers={'accept-encoding': 'gzip'})
+    assert response.content == b''.join(chunks)
+
+    # every chunk is decodable as soon as it is sent
+    decompressor = zlib.decompressobj(31)
+    for chunk, compressed in zip(chunks, sent):
+        assert decompressor.decompress(compressed) == chunk
+
+
+def test_compress_flush_delay(test_client_factory: TestClientFactory):
+    events: list[object] = []
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/plain')],
+            }
+        )
+        for i in range(2):
+            events.append(f'event {i}')
+            await send(
+                {
+                    'type': 'http.response.body',
+                    'body': f'data: {i}\n\n'.encode(),
+                    'more_body': True,
+                }
+            )
+            await anyio.sleep(0.1)
+        await send({'type': 'http.response.body'})
+
+    async def record(scope, receive, send):
+        async def wrapper(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                events.append(message['body'])
+            await send(message)
+
+        await middleware(scope, receive, wrapper)
+
+    for encoding, coalesce_size in product(('gzip', 'br', 'zstd'), (None, 1024)):
+        events.clear()
+        middleware = CompressMiddleware(
+            app, flush_delay=0.01, coalesce_size=coalesce_size
+        )
+        client = test_client_factory(record)
+        response = client.get('/', headers={'accept-encoding': encoding})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == encoding
+
+        # idle data is flushed before the next event
+        assert events[0] == 'event 0'
+        assert isinstance(events[1], bytes)
+        assert events.index('event 1') > 1
+
+
+def test_compress_coalesce_size(test_client_factory: TestClientFactory):
+    sent: list[bytes] = []
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/plain')],
+            }
+        )
+        for i in range(500):
+            await send(
+                {
+                    'type': 'http.response.body',
+                    'body': f'{i},row\n'.encode(),
+                    'more_body': True,
+                }
+            )
+        await send({'type': 'http.response.body'})
+
+    async def record(scope, receive, send):
+        async def wrapper(message):
+            if message['type'] == 'http.response.body':
+                sent.append(message.get('body', b''))
+            await send(message)
+
+        await middleware(scope, receive, wrapper)
+
+    middleware = CompressMiddleware(app, flush_size=0, coalesce_size=1024)
+    client = test_client_factory(record)
+    response = client.get('/', headers={'accept-encoding': 'gzip'})
+    assert response.text == ''.join(f'{i},row\n' for i in range(500))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(sent) < 10
+
+
+def test_compress_lookahead_size(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> StreamingResponse:
+        size = int(request.query_params['size'])
+
+        async def generator():
+            for _ in range(3):
+                yield b'x' * size
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, lookahead_size=64 * 1024)],
+    )
+
+    client = test_client_factory(app)
+
+    # small responses are not compressed
+    response = client.get('/?size=100', headers={'accept-encoding': 'gzip'})
+    assert response.text == 'x' * 300
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Length'] == '300'
+
+    # responses within the lookahead are compressed at once
+    response = client.get('/?size=1000', headers={'accept-encoding': 'gzip'})
+    assert response.text == 'x' * 3000
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) < 3000
+
+    # larger responses are streamed
+    response = client.get('/?size=30000', headers={'accept-encoding': 'gzip'})
+    assert response.text == 'x' * 90000
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+
+def test_compress_pool_reuse(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> StreamingResponse:
+        fail = 'fail' in request.query_params
+
+        async def generator():
+            for i in range(3):
+                if fail and i == 1:
+                    raise RuntimeError('stream failed')
+                yield b'x' * 1000
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, compressor_pool_size=1)],
+    )
+
+    client = test_client_factory(app)
+
+    for path in ('/', '/?fail', '/', '/'):
+        if path == '/?fail':
+            with pytest.raises(RuntimeError):
+                client.get(path, headers={'accept-encoding': 'zstd'})
+            continue
+        response = client.get(path, headers={'accept-encoding': 'zstd'})
+        assert response.text == 'x' * 3000
+        assert response.headers['Content-Encoding'] == 'zstd'
+
+
+def test_compressor_pool():
+    pool: CompressorPool[object] = CompressorPool(2)
+    a, b, c = object(), object(), object()
+    assert pool.get(('zstd', 1)) is None
+    pool.put(('zstd', 1), a)
+    pool.put(('zstd', 2), b)
+    pool.put(('zstd', 1), c)  # discarded, the pool is full
+    assert pool.size == 2
+    assert pool.get(('zstd', 1)) is a
+    assert pool.get(('zstd', 1)) is None
+    assert pool.get(('zstd', 2)) is b
+    assert pool.size == 0
+
+
+def test_compress_memory_budget(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> StreamingResponse:
+        async def generator():
+            for _ in range(3):
+                yield b'x' * 1000
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    for policy, encoding in (('identity', None), ('downgrade', 'br')):
+        budget = MemoryBudget(1024 * 1024, policy)
+        app = Starlette(
+            routes=[Route('/', endpoint=homepage)],
+            middleware=[Middleware(CompressMiddleware, memory_budget=budget)],
+        )
+        client = test_client_factory(app)
+
+        # streams start within the budget
+        response = client.get('/', headers={'accept-encoding': 'gzip'})
+        assert response.text == 'x' * 3000
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert budget.size == 0
+
+        # simulate other active streams, brotli fits only at the fastest quality
+        budget.size = 512 * 1024
+        response = client.get('/', headers={'accept-encoding': 'br'})
+        assert response.text == 'x' * 3000
+        assert response.headers.get('Content-Encoding') == encoding
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert budget.size == 512 * 1024
+
+        # gzip cannot be downgraded further
+        budget.size = 900 * 1024
+        response = client.get('/', headers={'accept-encoding': 'gzip'})
+        assert response.text == 'x' * 3000
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_memory_budget_wait():
+    async def main():
+        budget = MemoryBudget(300 * 1024, 'wait')
+        order: list[str] = []
+
+        async def stream(name: str):
+            reservation = await budget.reserve(GzipCodec(), 4)
+            assert reservation is not None
+            order.append(name)
+            await anyio.sleep(0.01)
+            budget.release(reservation[1])
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(stream, 'first')
+            await anyio.lowlevel.checkpoint()
+            tg.start_soon(stream, 'second')
+            await anyio.sleep(0.005)
+            assert order == ['first']
+
+        assert order == ['first', 'second']
+        assert budget.size == 0
+
+    anyio.run(main)
+
+    with pytest.raises(ValueError, match='Unsupported memory budget policy'):
+        MemoryBudget(1024, 'invalid')
+
+
+def test_compress_zstd_threads(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> Response:
+        body = b'{"x": 1}\n' * 20000
+        if 'stream' not in request.query_params:
+            return Response(body, media_type='application/json')
+
+        async def generator():
+            yield body[:100000]
+            yield body[100000:]
+
+        return StreamingResponse(
+            generator(),
+            media_type='application/json',
+            headers={'Content-Length': str(len(body))},
+        )
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[
+            Middleware(
+                CompressMiddleware, zstd_threads=2, zstd_threads_threshold=100000
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    for path in ('/', '/?stream'):
+        response = client.get(path, headers={'accept-encoding': 'zstd'})
+        assert response.content == b'{"x": 1}\n' * 20000
+        assert response.headers['Content-Encoding'] == 'zstd'
+        assert zstd_worker_threads.used == 0
+
+
+def test_compress_gzip_threads(test_client_factory: TestClientFactory):
+    rng = random.Random(42)  # noqa: S311
+    body = bytes(rng.choice(b'abcdefgh') for _ in range(300000))
+
+    def homepage(request: Request) -> Response:
+        return Response(
+            body[: int(request.query_params['size'])], media_type='text/plain'
+        )
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[
+            Middleware(CompressMiddleware, gzip_threads=2, gzip_threads_threshold=1000)
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    for size in (1000, 128 * 1024, 128 * 1024 + 1, 300000):
+        response = client.get(f'/?size={size}', headers={'accept-encoding': 'gzip'})
+        assert response.content == body[:size]
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert int(response.headers['Content-Length']) < size
+
+
+def test_compress_codecs(test_client_factory: TestClientFactory):
+    class CountingGzipCodec(GzipCodec):
+        __slots__ = ('calls',)
+
+        def __init__(self) -> None:
+            super().__init__(6)
+            self.calls = 0
+
+        def compress(self, body: bytes, level: int) -> bytes:
+            self.calls += 1
+            return super().compress(body, level)
+
+    def homepage(request: Request) -> Response:
+        if 'stream' not in request.query_params:
+            return PlainTextResponse('x' * 4000)
+
+        async def generator():
+            yield 'x' * 2000
+            yield 'x' * 2000
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    gzip_codec = CountingGzipCodec()
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[
+            Middleware(
+                CompressMiddleware,
+                preference=('deflate', 'gzip'),
+                codecs=[DeflateCodec(), gzip_codec],
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    for path in ('/', '/?stream'):
+        response = client.get(path, headers={'accept-encoding': 'deflate, gzip'})
+        assert response.text == 'x' * 4000
+        assert response.headers['Content-Encoding'] == 'deflate'
+
+        # the custom codec replaces the built-in gzip codec
+        response = client.get(path, headers={'accept-encoding': 'gzip'})
+        assert response.text == 'x' * 4000
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+    assert gzip_codec.calls == 1
+
+    with pytest.raises(ValueError, match='Unsupported encoding'):
+        CompressMiddleware(app, preference=('deflate',))
+
+
+def test_worker_threads():
+    threads = WorkerThreads(5)
+    assert threads.acquire(3) == 3
+    assert threads.acquire(3) == 2
+    assert threads.acquire(3) == 0  # a single worker thread is not used
+    threads.release(3)
+    assert threads.used == 2
+
+
+def test_decompress_requests(test_client_factory: TestClientFactory):
+    async def echo(request: Request) -> Response:
+        body = await request.body()
+        return Response(body, media_type='application/octet-stream')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=echo, methods=['POST'])],
+        middleware=[
+            Middleware(
+                CompressMiddleware, decompress_requests=True, request_max_size=10_000
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+    data = b'{"x": 1}\n' * 500
+
+    for encoding, content in (
+        ('gzip', gzip.compress(data)),
+        ('br', brotli.compress(data)),
+        ('identity', data),
+    ):
+        response = client.post(
+            '/', content=content, headers={'content-encoding': encoding}
+        )
+        assert response.status_code == 200
+        assert response.content == data
+
+    # too large
+    response = client.post(
+        '/', content=gzip.compress(data * 3), headers={'content-encoding': 'gzip'}
+    )
+    assert response.status_code == 413
+
+    # malformed
+    response = client.post('/', content=data, headers={'content-encoding': 'gzip'})
+    assert response.status_code == 400
+
+    # truncated
+    for encoding, content in (
+        ('gzip', gzip.compress(data)),
+        ('br', brotli.compress(data)),
+        ('zstd', zstd_compress(data)),
+    ):
+        response = client.post(
+            '/',
+            content=content[: len(content) // 2],
+            headers={'content-encoding': encoding},
+        )
+        assert response.status_code == 400
+
+
+def test_decompress_requests_ratio(test_client_factory: TestClientFactory):
+    async def echo(request: Request) -> Response:
+        body = await request.body()
+        return Response(str(len(body)), media_type='text/plain')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=echo, methods=['POST'])],
+        middleware=[Middleware(CompressMiddleware, decompress_requests=True)],
+    )
+
+    client = test_client_factory(app)
+    response = client.post(
+        '/',
+        content=gzip.compress(b'\0' * 1024 * 1024),
+        headers={'content-encoding': 'gzip'},
+    )
+    assert response.status_code == 413
+
+
+def test_decompress_requests_bounded(test_client_factory: TestClientFactory):
+    async def echo(request: Request) -> Response:
+        body = await request.body()
+        return Response(str(len(body)), media_type='text/plain')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=echo, methods=['POST'])],
+        middleware=[
+            Middleware(
+                CompressMiddleware, decompress_requests=True, request_max_ratio=1e9
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+    data = b'\0' * 32 * 1024 * 1024
+    for encoding, content in (
+        ('gzip', gzip.compress(data)),
+        ('br', brotli.compress(data, quality=1)),
+        ('zstd', zstd_compress(data)),
+    ):
+        assert len(content) < 64 * 1024
+        response = client.post(
+            '/', content=content, headers={'content-encoding': encoding}
+        )
+        assert response.status_code == 413
+
+        # the output is bounded near the limit, instead of the whole body
+        decompressor = _decompressor(encoding.encode())
+        assert decompressor is not None
+        assert len(decompressor.decompress(content, 1000)) <= 256 * 1024
+        assert not decompressor.eof
+
+
+def test_compress_rules(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000, status_code=200)
+
+    app = Starlette(
+        routes=[
+            Route('/', endpoint=homepage),
+            Route('/export/data', endpoint=homepage),
+            Route('/proxy', endpoint=homepage),
+            Route('/proxyless', endpoint=homepage),
+        ],
+        middleware=[
+            Middleware(
+                CompressMiddleware,
+                rules={'/export/': {'zstd': False, 'gzip_level': 9}, '/proxy': None},
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+    accept_encoding = {'accept-encoding': 'zstd, gzip'}
+
+    response = client.get('/', headers=accept_encoding)
+    assert response.headers['Content-Encoding'] == 'zstd'
+
+    response = client.get('/export/data', headers=accept_encoding)
+    assert response.text == 'x' * 4000
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+    response = client.get('/proxy', headers=accept_encoding)
+    assert response.text == 'x' * 4000
+    assert 'Content-Encoding' not in response.headers
+
+    response = client.get('/proxyless', headers=accept_encoding)
+    assert response.headers['Content-Encoding'] == 'zstd'
+
+
+def test_compress_rules_disabled(test_client_factory: TestClientFactory):
+    async def echo(request: Request) -> PlainTextResponse:
+        body = await request.body()
+        return PlainTextResponse(body.decode() * 1000, headers={'X-Compress': '9'})
+
+    app = Starlette(
+        routes=[
+            Route('/', endpoint=echo, methods=['POST']),
+            Route('/raw', endpoint=echo, methods=['POST']),
+        ],
+        middleware=[
+            Middleware(
+                CompressMiddleware,
+                decompress_requests=True,
+                codecs=(DeflateCodec(),),
+                preference=('deflate', 'gzip'),
+                rules={'/raw': None},
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+    headers = {'accept-encoding': 'deflate, gzip', 'content-encoding': 'gzip'}
+
+    response = client.post('/', content=gzip.compress(b'hello'), headers=headers)
+    assert response.text == 'hello' * 1000
+    assert response.headers['Content-Encoding'] == 'deflate'
+    assert 'X-Compress' not in response.headers
+
+    # disabled compression still removes the header and decompresses requests
+    response = client.post('/raw', content=gzip.compress(b'hello'), headers=headers)
+    assert response.text == 'hello' * 1000
+    assert 'Content-Encoding' not in response.headers
+    assert 'X-Compress' not in response.headers
+    assert 'Vary' not in response.headers
+
+
+def test_compress_response_override(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse(
+            'x' * 4000, headers={'X-Compress': request.query_params['compress']}
+        )
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br', 'zstd', 'identity'):
+        response = client.get('/?compress=off', headers={'accept-encoding': encoding})
+        assert response.text == 'x' * 4000
+        assert 'Content-Encoding' not in response.headers
+        assert 'X-Compress' not in response.headers
+
+    response = client.get('/?compress=0', headers={'accept-encoding': 'gzip'})
+    assert response.text == 'x' * 4000
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) > 4000
+    assert 'X-Compress' not in response.headers
+
+    # out of range levels are clamped
+    for encoding, level in product(('gzip', 'br', 'zstd'), ('-1000000', '99')):
+        response = client.get(
+            f'/?compress={level}', headers={'accept-encoding': encoding}
+        )
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == encoding
+        if encoding != 'zstd' or sys.version_info < (3, 14):
+            assert response.text == 'x' * 4000
+
+
+def test_compress_incompressible(test_client_factory: TestClientFactory):
+    rng = random.Random(42)  # noqa: S311
+    dense = rng.getrandbits(8 * 8000).to_bytes(8000, 'big')
+
+    def homepage(request: Request) -> Response:
+        body = dense if 'dense' in request.query_params else b'x' * 8000
+        if 'stream' not in request.query_params:
+            return Response(body, media_type='text/plain')
+
+        async def generator():
+            yield body
+            yield body
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, incompressible_threshold=0.9)],
+    )
+
+    client = test_client_factory(app)
+
+    for encoding in ('gzip', 'br', 'zstd'):
+        response = client.get('/?dense', headers={'accept-encoding': encoding})
+        assert response.content == dense
+        assert 'Content-Encoding' not in response.headers
+        assert response.headers['Content-Length'] == '8000'
+
+        response = client.get('/?dense&stream', headers={'accept-encoding': encoding})
+        assert response.content == dense * 2
+        assert 'Content-Encoding' not in response.headers
+
+        response = client.get('/?stream', headers={'accept-encoding': encoding})
+        assert response.content == b'x' * 16000
+        assert response.headers['Content-Encoding'] == encoding
+
+
+def test_compress_metrics(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> Response:
+        params = request.query_params
+        size = int(params.get('size', 4000))
+        headers = {'X-Compress': params['compress']} if 'compress' in params else None
+        if 'stream' not in params:
+            return Response(
+                'x' * size, media_type=params.get('type', 'text/plain'), headers=headers
+            )
+
+        async def generator():
+            for i in range(3):
+                if params['stream'] == 'fail' and i == 1:
+                    raise RuntimeError('stream failed')
+                yield b'x' * size
+
+        return StreamingResponse(generator(), media_type='text/plain')
+
+    records: list[CompressRecord] = []
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[Middleware(CompressMiddleware, metrics=records.append)],
+    )
+
+    client = test_client_factory(app)
+
+    for query, encoding, expected in (
+        ('', 'gzip', ('compressed', 'gzip', 4, False)),
+        ('stream=ok', 'br', ('compressed', 'br', 4, True)),
+        ('stream=ok', 'zstd', ('compressed', 'zstd', 4, True)),
+        ('size=100', 'zstd', ('small', 'zstd', None, False)),
+        ('type=image/png', 'gzip', ('ineligible', 'gzip', None, False)),
+        ('compress=off', 'gzip', ('disabled', 'gzip', None, False)),
+        ('', 'identity', ('unaccepted', 'identity', None, False)),
+    ):
+        records.clear()
+        response = client.get(f'/?{query}', headers={'accept-encoding': encoding})
+        assert len(records) == 1
+        record = records[0]
+        assert (record.reason, record.encoding, record.level, record.streaming) == (
+            expected
+        )
+        assert record.input_size == len(response.content)
+        if record.reason == 'compressed':
+            assert record.output_size < record.input_size
+            assert record.wall_time > 0
+        else:
+            assert record.output_size == record.input_size
+            assert record.wall_time == 0
+
+    records.clear()
+    with pytest.raises(RuntimeError):
+        client.get('/?stream=fail', headers={'accept-encoding': 'gzip'})
+    assert [record.reason for record in records] == ['aborted']
+    assert records[0].input_size == 4000
+
+
+def test_compress_metrics_offloaded(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> PlainTextResponse:
+        return PlainTextResponse('x' * 4000)
+
+    records: list[CompressRecord] = []
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage), Route('/local', endpoint=homepage)],
+        middleware=[
+            Middleware(
+                CompressMiddleware,
+                metrics=records.append,
+                offload_threshold=0,
+                rules={'/local': {'offload_threshold': None}},
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    # the cpu time of worker threads is unknown
+    for path, offloaded in (('/', True), ('/local', False)):
+        records.clear()
+        client.get(path, headers={'accept-encoding': 'gzip'})
+        assert records[0].reason == 'compressed'
+        assert records[0].wall_time > 0
+        assert (records[0].cpu_time is None) == offloaded
+
+    gzip_codec = GzipCodec(threads=2, threads_threshold=1000)
+    assert gzip_codec.offloaded(1000, None)
+    assert not gzip_codec.offloaded(999, None)
+
+
+def test_compress_content_types(test_client_factory: TestClientFactory):
+    def homepage(request: Request) -> Response:
+        return Response('x' * 4000, media_type=request.query_params['type'])
+
+    app = Starlette(
+        routes=[Route('/', endpoint=homepage)],
+        middleware=[
+            Middleware(
+                CompressMiddleware, content_types=['text/*', 'application/*+json']
+            )
+        ],
+    )
+
+    client = test_client_factory(app)
+
+    for content_type, compressed in (
+        ('text/csv', True),
+        ('application/vnd.api+json', True),
+        ('application/json', False),
+    ):
+        response = client.get(
+            '/', params={'type': content_type}, headers={'accept-encoding': 'gzip'}
+        )
+        assert response.text == 'x' * 4000
+        assert ('Content-Encoding' in response.headers) == compressed
+
+
+def test_content_type_matcher():
+    matcher = ContentTypeMatcher(['text/html', 'text/*', 'application/*+json'])
+    assert matcher(b'text/html')
+    assert matcher(b'Text/CSS; charset=utf-8')
+    assert matcher(b'application/ld+json')
+    assert not matcher(b'application/json')
+    assert not matcher(b'application/json+xml')
+    assert not matcher(b'image/png')
+    assert not matcher(b'text/plain/extra')
+    assert matcher(b'text/html')
+
+    matcher = ContentTypeMatcher()
+    assert matcher(b'application/json')
+    assert not matcher(b'test/test')
+    add_compress_type('test/test')
+    assert matcher(b'test/test')
+    remove_compress_type('test/test')
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('') == {}
+    assert parse_accept_encoding('gzip, deflate') == {'gzip': 1.0, 'deflate': 1.0}
+    assert parse_accept_encoding('br;q=1.0,gzip;q=0.8, *;q=0.1') == {
+        'br': 1.0,
+        'gzip': 0.8,
+        '*': 0.1,
+    }
+    assert parse_accept_encoding('GZIP;Q=0.5, br;q=invalid') == {'gzip': 0.5}
+
+
+def test_encode_headers():
+    headers = [
+        (b'content-type', b'text/plain'),
+        (b'content-length', b'1000'),
+        (b'etag', b'W/"abc"'),
+        (b'vary', b'Cookie'),
+    ]
+    encode_headers(headers, b'br', 100)
+    assert headers == [
+        (b'content-type', b'text/plain'),
+        (b'etag', b'W/"abc-br"'),
+        (b'vary', b'Cookie, Accept-Encoding'),
+        (b'content-encoding', b'br'),
+        (b'content-length', b'100'),
+    ]
+
+    headers = [(b'content-length', b'1000'), (b'etag', b'invalid')]
+    encode_headers(headers, b'gzip', None)
+    assert headers == [
+        (b'etag', b'invalid'),
+        (b'content-encoding', b'gzip'),
+        (b'vary', b'Accept-Encoding'),
+    ]
+
+
+def test_decode_etag_conditions():
+    scope = {'headers': [(b'if-none-match', b'"abc-br", W/"def-gzip", "ghi"')]}
+    assert decode_etag_conditions(scope)['headers'] == [
+        (b'if-none-match', b'"abc", W/"def", "ghi"')
+    ]
+    scope = {'headers': [(b'if-none-match', b'"abc"')]}
+    assert decode_etag_conditions(scope) is scope
+
+    scope = {'headers': [(b'if-match', b'"abc-deflate"')]}
+    assert decode_etag_conditions(scope) is scope
+    pattern = etag_encoding_pattern(('gzip', 'deflate'))
+    assert decode_etag_conditions(scope, pattern)['headers'] == [
+        (b'if-match', b'"abc"')
+    ]
+
+
+def test_negotiate_encoding():
+    encodings = ('zstd', 'br', 'gzip')
+    assert negotiate_encoding('', encodings) is None
+    assert negotiate_encoding('gzip, br', encodings) == 'br'
+    assert negotiate_encoding('gzip;q=1, br;q=0', encodings) == 'gzip'
+    assert negotiate_encoding('*', encodings) == 'zstd'
+    assert negotiate_encoding('*;q=0.5, gzip', encodings) == 'gzip'
+    assert negotiate_encoding('identity;q=0, *;q=0', encodings) is None
+    assert negotiate_encoding('deflate', encodings) is None
+
+
+def test_accepted_encodings():
+    encodings = ('zstd', 'br', 'gzip')
+    assert accepted_encodings('', encodings) == []
+    assert accepted_encodings('gzip, br', encodings) == ['br', 'gzip']
+    assert accepted_encodings('gzip;q=1, br;q=0.5, zstd;q=0', encodings) == [
+        'gzip',
+        'br',
+    ]
+    assert accepted_encodings('*', encodings) == ['zstd', 'br', 'gzip']
+    assert accepted_encodings('identity;q=0.5, gzip, br;q=0.4', encodings) == ['gzip']
+    assert accepted_encodings('identity, gzip;q=0.5', encodings) == []